@@ -0,0 +1,392 @@
+import asyncio
+import functools
+import io
+import json
+import secrets
+import time
+import zipfile
+from typing import List
+
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import Response, JSONResponse, StreamingResponse
+
+import batch
+import ingest
+import pipeline
+from processor import ImageProcessor, ImageTooLargeError
+from store import load_upload, store_upload
+from workers import pool, PoolBusyError, PoolTimeoutError
+
+router = APIRouter(prefix="/api", tags=["api"])
+
+IMAGE_TYPES = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+SUPPORTED_TYPES = ("application/json", "multipart/mixed") + tuple(IMAGE_TYPES)
+
+
+def parse_accept(accept):
+    """Разбирает заголовок Accept в список (тип, q), отсортированный по убыванию q"""
+    items = []
+    for order, part in enumerate((accept or "*/*").split(",")):
+        media, *options = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for option in options:
+            if option.startswith("q="):
+                try:
+                    q = float(option[2:])
+                except ValueError:
+                    q = 0.0
+        if media and q > 0:
+            items.append((media.lower(), q, order))
+    items.sort(key=lambda item: (-item[1], item[2]))
+    return [(media, q) for media, q, _ in items]
+
+
+def negotiate(accept):
+    """
+    Выбирает формат ответа по Accept.
+    Возвращает (тип ответа, расширение изображения) или None, если ничего не подходит.
+    Расширение None — формат изображения выбирается по содержимому
+    (PNG для карты краёв, JPEG для фотографий).
+    """
+    accepted = parse_accept(accept)
+    # Формат картинки: первый явно запрошенный image/*
+    image_ext = next((IMAGE_TYPES[m] for m, _ in accepted if m in IMAGE_TYPES), None)
+    for media, _ in accepted:
+        if media in IMAGE_TYPES:
+            return media, IMAGE_TYPES[media]
+        if media in SUPPORTED_TYPES:
+            return media, image_ext
+        if media == "image/*":
+            return media, None
+        if media in ("*/*", "application/*"):
+            return "application/json", image_ext
+    return None
+
+
+def result_metadata(result):
+    return {
+        "image_id": result["image_id"],
+        "method": result["method"],
+        "preview": result["preview"],
+        "width": result["width"],
+        "height": result["height"],
+        "channels": result["channels"],
+        "format": result["media_type"],
+        "histogram": result["histogram"],
+        "original_histogram": result["original_histogram"],
+    }
+
+
+def multipart_response(metadata, image_bytes, image_type):
+    """Ответ multipart/mixed: часть с JSON-метаданными и часть с изображением"""
+    boundary = secrets.token_hex(16)
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        json.dumps(metadata).encode(),
+        f"\r\n--{boundary}\r\nContent-Type: {image_type}\r\n"
+        f"Content-Disposition: attachment; filename=\"result{IMAGE_TYPES[image_type]}\"\r\n\r\n".encode(),
+        image_bytes,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return Response(body, media_type=f"multipart/mixed; boundary={boundary}")
+
+
+@router.post("/process")
+async def api_process(
+    request: Request,
+    file: UploadFile = File(None),
+    method: str = Form(...),
+    image_id: str = Form(None),
+    canny_t1: int = Form(50),
+    canny_t2: int = Form(150),
+    hough_thresh: int = Form(50),
+    hough_min_len: int = Form(50),
+    hough_max_gap: int = Form(10),
+    preview: bool = Form(False),
+):
+    """
+    Обработка для программных клиентов. Формат ответа выбирается по Accept:
+    image/jpeg, image/png или image/webp — байты результата (image/* — формат по
+    содержимому), multipart/mixed — JSON + изображение, application/json — метаданные
+    и гистограммы в виде массивов.
+    """
+    negotiated = negotiate(request.headers.get("accept"))
+    if negotiated is None:
+        raise HTTPException(status_code=406, detail=f"Поддерживаемые форматы: {', '.join(SUPPORTED_TYPES)}")
+    media_type, image_ext = negotiated
+
+    if file and file.filename:
+        try:
+            file_bytes = await ingest.read_upload(file)
+        except (ingest.UploadTooLargeError, ImageTooLargeError) as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        image_id = await store_upload(file_bytes)
+    elif image_id:
+        file_bytes = await load_upload(image_id)
+        if file_bytes is None:
+            raise HTTPException(status_code=410, detail="Изображение устарело или не найдено")
+    else:
+        raise HTTPException(status_code=400, detail="Необходимо передать file или image_id")
+
+    params = {
+        "canny_t1": canny_t1, "canny_t2": canny_t2,
+        "hough_thresh": hough_thresh, "hough_min_len": hough_min_len, "hough_max_gap": hough_max_gap
+    }
+
+    try:
+        result = await pool.run(ImageProcessor.process_raw, file_bytes, method, params, image_id, image_ext, preview)
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Ошибка обработки: {e}")
+
+    metadata = result_metadata(result)
+    if media_type == "application/json":
+        return JSONResponse(metadata)
+    if media_type == "multipart/mixed":
+        return multipart_response(metadata, result["image"], result["media_type"])
+    return Response(result["image"], media_type=result["media_type"], headers={
+        "X-Image-Id": result["image_id"],
+        "X-Image-Width": str(result["width"]),
+        "X-Image-Height": str(result["height"]),
+    })
+
+
+def parse_values(value):
+    """
+    Значения параметра для перебора: "50", "10,20,40" или диапазон "10:100:10"
+    (start:stop:step, stop включительно)
+    """
+    value = str(value).strip()
+    if ":" in value:
+        parts = [int(p) for p in value.split(":")]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Диапазон должен иметь вид start:stop[:step]: {value}")
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else 1
+        if step <= 0 or stop < start:
+            raise ValueError(f"Некорректный диапазон: {value}")
+        # range, а не список: размер известен без построения, огромный диапазон отклоняется по len()
+        return range(start, stop + 1, step)
+    values = [int(p) for p in value.split(",") if p.strip()]
+    if not values:
+        raise ValueError(f"Не заданы значения параметра: {value!r}")
+    return values
+
+
+@router.post("/sweep")
+async def api_sweep(
+    request: Request,
+    file: UploadFile = File(None),
+    method: str = Form(...),
+    image_id: str = Form(None),
+    canny_t1: str = Form("50"),
+    canny_t2: str = Form("150"),
+    hough_thresh: str = Form("50"),
+    hough_min_len: str = Form("50"),
+    hough_max_gap: str = Form("10"),
+):
+    """
+    Перебор параметров canny/hough по сетке. Каждый параметр задаётся числом,
+    списком "a,b,c" или диапазоном "start:stop:step". Формат ответа по Accept:
+    image/* — контактный лист, application/json — сводка по каждой комбинации
+    (число пикселей краёв или координаты найденных линий), multipart/mixed — оба.
+    """
+    negotiated = negotiate(request.headers.get("accept"))
+    if negotiated is None:
+        raise HTTPException(status_code=406, detail=f"Поддерживаемые форматы: {', '.join(SUPPORTED_TYPES)}")
+    media_type, image_ext = negotiated
+
+    try:
+        grid = {
+            "canny_t1": parse_values(canny_t1), "canny_t2": parse_values(canny_t2),
+            "hough_thresh": parse_values(hough_thresh), "hough_min_len": parse_values(hough_min_len),
+            "hough_max_gap": parse_values(hough_max_gap),
+        }
+        ImageProcessor.sweep_size(method, grid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if file and file.filename:
+        try:
+            file_bytes = await ingest.read_upload(file)
+        except (ingest.UploadTooLargeError, ImageTooLargeError) as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        image_id = await store_upload(file_bytes)
+    elif image_id:
+        file_bytes = await load_upload(image_id)
+        if file_bytes is None:
+            raise HTTPException(status_code=410, detail="Изображение устарело или не найдено")
+    else:
+        raise HTTPException(status_code=400, detail="Необходимо передать file или image_id")
+
+    try:
+        result = await pool.run(ImageProcessor.process_sweep, file_bytes, method, grid, image_id, image_ext)
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Ошибка обработки: {e}")
+
+    metadata = {"image_id": result["image_id"], "method": result["method"], "results": result["results"]}
+    if media_type == "application/json":
+        return JSONResponse(metadata)
+    if media_type == "multipart/mixed":
+        return multipart_response(metadata, result["image"], result["media_type"])
+    return Response(result["image"], media_type=result["media_type"], headers={"X-Image-Id": result["image_id"]})
+
+
+def read_zip_entry(archive, info):
+    """Распаковывает элемент архива, не больше MAX_UPLOAD_BYTES (размер в заголовке мог быть ложным)"""
+    with archive.open(info) as entry:
+        data = entry.read(ingest.MAX_UPLOAD_BYTES + 1)
+    if len(data) > ingest.MAX_UPLOAD_BYTES:
+        raise ingest.UploadTooLargeError(ingest.too_large_message(ingest.MAX_UPLOAD_BYTES))
+    return data
+
+
+def read_batch_inputs(uploads):
+    """
+    Собирает (имя, функция чтения байтов) из списка файлов; zip-архивы раскрываются.
+    Элементы архивов распаковываются только при вызове функции, а их размеры заранее
+    проверяются по заголовкам: каждый не больше MAX_UPLOAD_BYTES, все вместе — не больше
+    MAX_UNPACKED_BYTES. Имена, совпадающие без расширения (в результате это был бы один
+    файл), получают префикс с порядковым номером.
+    Возвращает (элементы, открытые архивы) — архивы закрывает вызывающий.
+    """
+    items, archives, seen = [], [], set()
+    unpacked = 0
+
+    def add(name, read):
+        items.append((batch.unique_name(name, len(items), seen), read))
+
+    try:
+        for upload, data in uploads:
+            if not upload.filename.lower().endswith('.zip'):
+                add(upload.filename, lambda data=data: data)
+                continue
+            archive = zipfile.ZipFile(io.BytesIO(data))
+            archives.append(archive)
+            for info in archive.infolist():
+                if info.is_dir() or not batch.is_image_name(info.filename):
+                    continue
+                if info.file_size > ingest.MAX_UPLOAD_BYTES:
+                    raise ingest.UploadTooLargeError(
+                        f"{info.filename}: {ingest.too_large_message(ingest.MAX_UPLOAD_BYTES)}")
+                unpacked += info.file_size
+                if unpacked > ingest.MAX_UNPACKED_BYTES:
+                    raise ingest.UploadTooLargeError(
+                        f"Архивы после распаковки больше {ingest.MAX_UNPACKED_BYTES / (1024 * 1024):g} МБ")
+                add(info.filename, functools.partial(read_zip_entry, archive, info))
+    except Exception:
+        for archive in archives:
+            archive.close()
+        raise
+    return items, archives
+
+
+async def run_in_pool_with_retry(func, *args):
+    """Для пакетов: при заполненной очереди ждём свободного места вместо немедленного 503"""
+    deadline = time.monotonic() + pool.timeout
+    while True:
+        try:
+            return await pool.run(func, *args)
+        except PoolBusyError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+@router.post("/batch")
+async def api_batch(
+    files: List[UploadFile] = File(...),
+    method: str = Form(...),
+    output_format: str = Form("jpg"),
+    canny_t1: int = Form(50),
+    canny_t2: int = Form(150),
+    hough_thresh: int = Form(50),
+    hough_min_len: int = Form(50),
+    hough_max_gap: int = Form(10),
+):
+    """
+    Пакетная обработка списка файлов или zip-архива. Ответ — zip, который отдаётся
+    по мере готовности изображений; последним файлом идёт report.json с временем по
+    каждому изображению и общей пропускной способностью.
+    """
+    try:
+        pipeline.parse(method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if output_format not in ("jpg", "png"):
+        raise HTTPException(status_code=400, detail="output_format: jpg или png")
+    ext = '.' + output_format
+
+    try:
+        # Отдельные файлы проверяет сам пакет; здесь — только общий размер (zip может быть большим)
+        uploads = [(upload, await ingest.read_upload(upload, ingest.MAX_REQUEST_BYTES, check_image=False))
+                   for upload in files]
+        items, archives = read_batch_inputs(uploads)
+    except ingest.UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Повреждённый zip-архив")
+    if not items:
+        for archive in archives:
+            archive.close()
+        raise HTTPException(status_code=400, detail="В запросе нет изображений")
+
+    params = {
+        "canny_t1": canny_t1, "canny_t2": canny_t2,
+        "hough_thresh": hough_thresh, "hough_min_len": hough_min_len, "hough_max_gap": hough_max_gap
+    }
+
+    async def process_item(name, read):
+        try:
+            # Элемент архива распаковывается только сейчас, вне цикла событий
+            data = await asyncio.to_thread(read)
+            encoded, timings = await run_in_pool_with_retry(batch.process_bytes, data, method, params, ext)
+        except Exception as e:
+            return name, None, {'name': name, 'error': str(e)}
+        return name, encoded, {'name': name, 'bytes_in': len(data), 'bytes_out': len(encoded), **timings}
+
+    async def stream():
+        start = time.perf_counter()
+        buffer = batch.ZipStream()
+        reports = []
+        # Не больше pool.workers изображений в работе одновременно
+        limit = asyncio.Semaphore(pool.workers)
+
+        async def bounded(name, read):
+            async with limit:
+                return await process_item(name, read)
+
+        try:
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for task in asyncio.as_completed([bounded(name, read) for name, read in items]):
+                    name, encoded, report = await task
+                    reports.append(report)
+                    if encoded is not None:
+                        batch.zip_entry(archive, batch.result_name(name, ext), encoded)
+                        yield buffer.pop()
+                summary = batch.summarize(reports, time.perf_counter() - start)
+                reports.sort(key=lambda r: r['name'])
+                batch.zip_entry(archive, 'report.json',
+                                json.dumps({'summary': summary, 'images': reports}, ensure_ascii=False, indent=2).encode())
+            yield buffer.pop()
+        finally:
+            for source in archives:
+                source.close()
+
+    return StreamingResponse(stream(), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="results.zip"'})
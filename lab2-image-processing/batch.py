@@ -0,0 +1,226 @@
+"""
+Пакетная обработка: один метод ImageProcessor для множества изображений.
+
+Пример:
+    python batch.py images/ --method canny --out results/ --workers 4
+    python batch.py images/hough --method eq_hsv,canny,hough --out results/
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pipeline
+from processor import ImageProcessor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def find_images(root):
+    """Рекурсивно собирает пути к изображениям в каталоге (в стабильном порядке)"""
+    if os.path.isfile(root):
+        return [root]
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if is_image_name(name))
+    return sorted(paths)
+
+
+def result_name(name, ext):
+    """Имя файла результата: тот же относительный путь, расширение формата вывода"""
+    return os.path.splitext(name)[0] + ext
+
+
+def unique_name(name, index, seen):
+    """
+    Имя, результат которого (см. result_name) не совпадёт с уже выданными: входы,
+    совпадающие без расширения (x.jpg и x.png), получают префикс с номером index
+    у имени файла. seen — множество выданных имён без расширения, пополняется.
+    """
+    head, tail = os.path.split(name)
+    unique = name
+    while os.path.splitext(unique)[0] in seen:
+        tail = f"{index}_{tail}"
+        unique = os.path.join(head, tail)
+    seen.add(os.path.splitext(unique)[0])
+    return unique
+
+
+def process_bytes(file_bytes, method, params, ext='.jpg'):
+    """
+    decode -> метод -> encode для одного изображения без кэшей и base64.
+    Возвращает (байты результата, словарь с временем этапов в мс).
+    """
+    t0 = time.perf_counter()
+    ImageProcessor.check_dimensions(file_bytes)
+    img = ImageProcessor.bytes_to_image(file_bytes)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    t1 = time.perf_counter()
+    res_img = ImageProcessor.apply_method(img, method, params)
+    t2 = time.perf_counter()
+    encoded = ImageProcessor.encode_image(res_img, ext)
+    t3 = time.perf_counter()
+    return encoded, {
+        'decode_ms': (t1 - t0) * 1000,
+        'process_ms': (t2 - t1) * 1000,
+        'encode_ms': (t3 - t2) * 1000,
+        'total_ms': (t3 - t0) * 1000,
+        'megapixels': img.shape[0] * img.shape[1] / 1e6,
+    }
+
+
+def process_path(path, out_path, method, params, ext):
+    """Задача для процесса-воркера: читает файл сам и пишет результат на диск (без пересылки байтов)"""
+    try:
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        encoded, timings = process_bytes(file_bytes, method, params, ext)
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        with open(out_path, 'wb') as f:
+            f.write(encoded)
+        return {'name': path, 'output': out_path, 'bytes_in': len(file_bytes),
+                'bytes_out': len(encoded), **timings}
+    except Exception as e:
+        return {'name': path, 'error': str(e)}
+
+
+def run_batch(paths, out_dir, method, params, ext='.jpg', workers=None, root=None):
+    """
+    Обрабатывает файлы в пуле процессов, держа в работе не больше 2*workers задач.
+    Отдаёт отчёты по мере готовности (генератор).
+    """
+    workers = workers or os.cpu_count() or 1
+    root = root or (os.path.commonpath(paths) if paths else '.')
+    if os.path.isfile(root):
+        root = os.path.dirname(root)
+    pending = set()
+    seen = set()
+    queue = enumerate(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for index, path in queue:
+                name = unique_name(os.path.relpath(path, root), index, seen)
+                out_path = os.path.join(out_dir, result_name(name, ext))
+                pending.add(executor.submit(process_path, path, out_path, method, params, ext))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def summarize(reports, elapsed):
+    """Сводка: количество, ошибки, пропускная способность (изображений/с и МП/с)"""
+    ok = [r for r in reports if 'error' not in r]
+    megapixels = sum(r['megapixels'] for r in ok)
+    return {
+        'images': len(reports),
+        'failed': len(reports) - len(ok),
+        'elapsed_s': elapsed,
+        'images_per_s': len(ok) / elapsed if elapsed > 0 else 0.0,
+        'megapixels_per_s': megapixels / elapsed if elapsed > 0 else 0.0,
+        'bytes_in': sum(r['bytes_in'] for r in ok),
+        'bytes_out': sum(r['bytes_out'] for r in ok),
+    }
+
+
+class ZipStream(io.RawIOBase):
+    """Неперематываемый буфер для zipfile: архив отдаётся клиенту по частям"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_entry(archive, name, data):
+    # Изображения уже сжаты — храним без повторного сжатия
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    archive.writestr(info, data)
+
+
+def method_arg(value):
+    """Проверка --method: один метод или цепочка через запятую"""
+    try:
+        pipeline.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def build_params(args):
+    return {
+        "canny_t1": args.canny_t1, "canny_t2": args.canny_t2,
+        "hough_thresh": args.hough_thresh, "hough_min_len": args.hough_min_len,
+        "hough_max_gap": args.hough_max_gap,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка изображений методами ImageProcessor")
+    parser.add_argument("input", help="Файл или каталог с изображениями")
+    parser.add_argument("--method", required=True, type=method_arg,
+                        help=f"Метод или цепочка через запятую: {', '.join(pipeline.STAGES)}")
+    parser.add_argument("--out", default="results", help="Каталог для результатов")
+    parser.add_argument("--format", default="jpg", choices=("jpg", "png"))
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию — число ядер)")
+    parser.add_argument("--report", help="Сохранить отчёт в JSON")
+    parser.add_argument("--canny-t1", type=int, default=50)
+    parser.add_argument("--canny-t2", type=int, default=150)
+    parser.add_argument("--hough-thresh", type=int, default=50)
+    parser.add_argument("--hough-min-len", type=int, default=50)
+    parser.add_argument("--hough-max-gap", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.input)
+    if not paths:
+        print(f"Изображения не найдены: {args.input}", file=sys.stderr)
+        return 1
+
+    ext = '.' + args.format
+    reports = []
+    start = time.perf_counter()
+    for report in run_batch(paths, args.out, args.method, build_params(args), ext,
+                            args.workers, root=args.input):
+        reports.append(report)
+        if 'error' in report:
+            print(f"ОШИБКА {report['name']}: {report['error']}")
+        else:
+            print(f"{report['name']}: {report['total_ms']:.1f} мс "
+                  f"(decode {report['decode_ms']:.1f}, {args.method} {report['process_ms']:.1f}, "
+                  f"encode {report['encode_ms']:.1f}), {report['megapixels']:.2f} МП")
+    summary = summarize(reports, time.perf_counter() - start)
+    print(f"Итого: {summary['images']} изображений, ошибок {summary['failed']}, "
+          f"{summary['elapsed_s']:.2f} с, {summary['images_per_s']:.2f} изобр./с, "
+          f"{summary['megapixels_per_s']:.2f} МП/с")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'images': reports}, f, ensure_ascii=False, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Бенчмарк ImageProcessor и эндпоинта /process.
+
+Примеры:
+    python bench.py                                  # этапы + эндпоинт, вывод таблицы
+    python bench.py --save baseline.json             # сохранить базовую линию
+    python bench.py --compare baseline.json          # сравнить с базовой линией
+    python bench.py --skip-endpoint --resolutions 640x480,3840x2160
+
+Замер эндпоинта выполняется in-process через httpx.ASGITransport (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import batch
+from cache import source_cache, result_cache
+from processor import ImageProcessor
+
+DEFAULT_RESOLUTIONS = "640x480,1920x1080,4000x3000"
+PARAMS = {
+    "canny_t1": 50, "canny_t2": 150,
+    "hough_thresh": 50, "hough_min_len": 50, "hough_max_gap": 10,
+}
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64)
+    return {
+        "n": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ (None, если модуль resource недоступен, например в Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_image(width, height, seed=0):
+    """Детерминированное тестовое изображение: градиент, шум и отрезки (есть что искать Хафу)"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.dstack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))])
+    img = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    for _ in range(40):
+        p1 = (int(rng.integers(width)), int(rng.integers(height)))
+        p2 = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.line(img, p1, p2, color, max(1, width // 400))
+    return img
+
+
+def load_inputs(resolutions, corpus_dir, corpus_limit):
+    """Список (имя, байты JPEG): синтетика нужных разрешений + файлы из images/"""
+    inputs = []
+    for res in resolutions:
+        w, h = (int(v) for v in res.lower().split("x"))
+        inputs.append((f"synthetic_{w}x{h}", ImageProcessor.encode_image(synthetic_image(w, h), ".jpg", 95)))
+    if corpus_dir and os.path.isdir(corpus_dir):
+        for path in batch.find_images(corpus_dir)[:corpus_limit]:
+            with open(path, "rb") as f:
+                inputs.append((os.path.relpath(path, corpus_dir), f.read()))
+    return inputs
+
+
+def time_call(func, repeat):
+    func()  # прогрев
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def bench_stages(inputs, repeat):
+    """Время каждого этапа на каждом входе"""
+    stages = {
+        "apply_canny": lambda img: ImageProcessor.apply_canny(img, 50, 150),
+        "apply_hough_lines": lambda img: ImageProcessor.apply_hough_lines(img, 50, 50, 10),
+        "apply_linear_contrast": ImageProcessor.apply_linear_contrast,
+        "apply_equalize_rgb": ImageProcessor.apply_equalize_rgb,
+        "apply_equalize_hsv": ImageProcessor.apply_equalize_hsv,
+        "create_histogram": ImageProcessor.create_histogram,
+        "image_to_base64": ImageProcessor.image_to_base64,
+    }
+    results = {}
+    for name, file_bytes in inputs:
+        img = ImageProcessor.bytes_to_image(file_bytes)
+        entry = {
+            "megapixels": img.shape[0] * img.shape[1] / 1e6,
+            "bytes_to_image": percentiles(time_call(lambda: ImageProcessor.bytes_to_image(file_bytes), repeat)),
+        }
+        for stage_name, func in stages.items():
+            entry[stage_name] = percentiles(time_call(lambda: func(img), repeat))
+        results[name] = entry
+    return results
+
+
+async def _endpoint_run(inputs, requests_total, concurrency, method):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(i):
+            name, file_bytes = inputs[i % len(inputs)]
+            async with semaphore:
+                t0 = time.perf_counter()
+                response = await client.post("/process", data={"method": method, **PARAMS},
+                                             files={"file": (name, file_bytes, "image/jpeg")})
+                latencies.append((time.perf_counter() - t0) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests_total)))
+        elapsed = time.perf_counter() - start
+    main.pool.shutdown()
+    return latencies, statuses, elapsed
+
+
+def bench_endpoint(inputs, requests_total, concurrency, method):
+    """Латентность и пропускная способность /process при заданной конкурентности"""
+    latencies, statuses, elapsed = asyncio.run(_endpoint_run(inputs, requests_total, concurrency, method))
+    return {
+        "method": method,
+        "concurrency": concurrency,
+        "requests": requests_total,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "req_per_s": requests_total / elapsed if elapsed > 0 else 0.0,
+        **percentiles(latencies),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance, min_delta_ms=0.5):
+    """
+    Сравнивает p50 этапов и перцентили эндпоинта; возвращает список регрессий (строки).
+    Разница меньше min_delta_ms не считается — у субмиллисекундных этапов она в пределах шума.
+    """
+    regressions = []
+
+    def check(label, new, old):
+        if old and new > old * (1 + tolerance) and new - old >= min_delta_ms:
+            regressions.append(f"{label}: {old:.2f} -> {new:.2f} мс (+{(new / old - 1) * 100:.0f}%)")
+
+    for name, stages in current.get("stages", {}).items():
+        old_stages = baseline.get("stages", {}).get(name, {})
+        for stage_name, stats in stages.items():
+            if isinstance(stats, dict) and stage_name in old_stages:
+                check(f"{name} / {stage_name}", stats["p50_ms"], old_stages[stage_name]["p50_ms"])
+    if "endpoint" in current and "endpoint" in baseline:
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            check(f"/process {key}", current["endpoint"][key], baseline["endpoint"][key])
+    return regressions
+
+
+def print_report(report):
+    for name, stages in report.get("stages", {}).items():
+        print(f"\n{name} ({stages['megapixels']:.2f} МП)")
+        for stage_name, stats in stages.items():
+            if isinstance(stats, dict):
+                print(f"  {stage_name:<24} p50 {stats['p50_ms']:8.2f} мс   p95 {stats['p95_ms']:8.2f} мс")
+    if "endpoint" in report:
+        e = report["endpoint"]
+        print(f"\n/process [{e['method']}] x{e['requests']}, конкурентность {e['concurrency']}: "
+              f"{e['req_per_s']:.1f} req/s, p50 {e['p50_ms']:.1f} / p95 {e['p95_ms']:.1f} / "
+              f"p99 {e['p99_ms']:.1f} мс, статусы {e['statuses']}")
+    if report.get("peak_rss_mb") is not None:
+        print(f"\nПиковый RSS: {report['peak_rss_mb']:.1f} МБ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк ImageProcessor и /process")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="Синтетические изображения, WxH через запятую")
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "images"))
+    parser.add_argument("--corpus-limit", type=int, default=5, help="Сколько файлов взять из корпуса")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов на этап")
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--skip-endpoint", action="store_true")
+    parser.add_argument("--method", default="canny", help="Метод для замера эндпоинта")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--with-cache", action="store_true", help="Не отключать кэши при замере эндпоинта")
+    parser.add_argument("--save", help="Сохранить результат в JSON")
+    parser.add_argument("--compare", help="Сравнить с сохранённым JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое замедление p50 (доля)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Минимальная значимая разница, мс")
+    args = parser.parse_args(argv)
+    # main.py ищет шаблоны относительно текущего каталога
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    resolutions = [r for r in args.resolutions.split(",") if r.strip()]
+    inputs = load_inputs(resolutions, args.corpus, args.corpus_limit)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+    if not args.skip_stages:
+        report["stages"] = bench_stages(inputs, args.repeat)
+    if not args.skip_endpoint:
+        if not args.with_cache:
+            # Нулевой бюджет: кэши ничего не сохраняют, меряем полную обработку
+            source_cache.max_bytes = result_cache.max_bytes = 0
+        try:
+            report["endpoint"] = bench_endpoint(inputs, args.requests, args.concurrency, args.method)
+        except ImportError as e:
+            print(f"Замер эндпоинта пропущен: {e} (нужен httpx)", file=sys.stderr)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        print(f"\nСравнение с {args.compare} (git {baseline.get('git')}), допуск {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  РЕГРЕССИЯ {line}")
+        if not regressions:
+            print("  регрессий нет")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
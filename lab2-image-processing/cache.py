@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def estimate_size(value):
+    """Грубая оценка занимаемой памяти (байты) для массивов, строк и контейнеров"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 64
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по памяти и времени жизни записей.
+    max_bytes — бюджет памяти, ttl — время жизни записи в секундах (None — бессрочно).
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=None, ttl=None):
+        """ttl — время жизни этой записи, если оно короче общего (например, остаток срока)"""
+        size = estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        ttl = min(ttl, self.ttl) if ttl is not None and self.ttl else (ttl or self.ttl)
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _env_mb(name, default):
+    return int(float(os.environ.get(name, default)) * 1024 * 1024)
+
+
+_ttl = float(os.environ.get("CV_CACHE_TTL", 600)) or None
+
+# Уровень 1: хэш содержимого -> декодированное изображение, превью оригинала и его гистограмма
+source_cache = LRUCache(_env_mb("CV_SOURCE_CACHE_MB", 256), ttl=_ttl)
+# Уровень 2: (хэш, метод, нормализованные параметры) -> готовый результат
+result_cache = LRUCache(_env_mb("CV_RESULT_CACHE_MB", 64), ttl=_ttl)
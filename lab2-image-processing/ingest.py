@@ -0,0 +1,92 @@
+"""
+Приём загрузок без лишних копий в памяти.
+
+- BodyLimitMiddleware — ASGI-middleware: отклоняет запрос с 413 по Content-Length
+  или как только прочитанное тело превысит лимит, не дожидаясь конца загрузки.
+- read_upload() — читает файл формы по частям (Starlette держит его во временном
+  файле, который уходит на диск после 1 МБ), проверяет лимит размера и размеры
+  изображения по заголовку из первой части — до того, как файл прочитан целиком.
+"""
+import json
+import os
+
+from fastapi import HTTPException
+
+from processor import ImageProcessor
+
+# Лимит одного файла и всего тела запроса (пакет может содержать несколько файлов)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("CV_MAX_UPLOAD_MB", 50)) * 1024 * 1024)
+MAX_REQUEST_BYTES = int(float(os.environ.get("CV_MAX_REQUEST_MB", 200)) * 1024 * 1024)
+# Суммарный размер изображений из zip-архивов пакета после распаковки
+MAX_UNPACKED_BYTES = int(float(os.environ.get("CV_MAX_UNPACKED_MB", 1024)) * 1024 * 1024)
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Файл больше допустимого размера"""
+
+
+def too_large_message(max_bytes):
+    return f"Файл больше {max_bytes / (1024 * 1024):g} МБ"
+
+
+async def read_upload(upload, max_bytes=MAX_UPLOAD_BYTES, check_image=True):
+    """
+    Читает UploadFile по частям. UploadTooLargeError — при превышении max_bytes,
+    ImageTooLargeError — если заголовок изображения говорит о слишком большом кадре.
+    """
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLargeError(too_large_message(max_bytes))
+        if check_image and not chunks:
+            ImageProcessor.check_dimensions(chunk)
+        chunks.append(chunk)
+    # Для одной части join возвращает её же, без копирования
+    return b"".join(chunks)
+
+
+class BodyLimitMiddleware:
+    """ASGI-middleware: ограничение размера тела запроса, проверяемое по мере чтения"""
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope.get("headers") or []).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI пробрасывает HTTPException из разбора формы как есть
+                    raise HTTPException(status_code=413, detail=too_large_message(self.max_bytes))
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": too_large_message(self.max_bytes)}, ensure_ascii=False).encode()
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -1,27 +1,66 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from processor import ImageProcessor
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from processor import ImageProcessor, ImageTooLargeError
+from workers import pool, PoolBusyError, PoolTimeoutError
+from cache import source_cache, result_cache
+from store import image_store, load_upload, store_upload
+import api
+import ingest
+import metrics
 
-app = FastAPI(title="Image Processing Lab")
+@asynccontextmanager
+async def lifespan(app):
+    pool.start()
+    yield
+    pool.shutdown()
+
+app = FastAPI(title="Image Processing Lab", lifespan=lifespan)
+app.include_router(api.router)
+# Лимит тела запроса проверяется при чтении, до разбора всей формы
+app.add_middleware(ingest.BodyLimitMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Значения, которые читаются в момент запроса /metrics
+metrics.Gauge("cv_pool_pending", "Задачи в пуле обработки (выполняются и ждут)",
+              func=lambda: {(): pool.pending})
+metrics.Gauge("cv_cache_stat", "Счётчики кэшей и хранилища изображений", ("cache", "field"),
+              func=lambda: {
+                  (name, field): value
+                  for name, cache in (("source", source_cache), ("result", result_cache), ("images", image_store))
+                  for field, value in cache.stats().items()
+              })
 
 # Настройка шаблонов
 templates = Jinja2Templates(directory="templates")
 
-# Увеличиваем лимит размера запроса
-from starlette.requests import Request as StarletteRequest
-StarletteRequest.max_body_size = 50 * 1024 * 1024  # 50MB
-
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Отображает главную страницу"""
     return templates.TemplateResponse("index.html", {"request": request, "result": None})
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Счётчики попаданий/промахов кэша для подбора его размера"""
+    return {
+        "workers": {"kind": pool.kind, "size": pool.workers, "pending": pool.pending},
+        "source": source_cache.stats(),
+        "result": result_cache.stats(),
+        "images": image_store.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/process", response_class=HTMLResponse)
 async def process_image(
     request: Request,
     file: UploadFile = File(None),
     method: str = Form(...),
+    image_id: str = Form(None),
     original_data: str = Form(None),
     # Параметры формы (делаем их Optional, так как не все нужны сразу)
     canny_t1: int = Form(50),
@@ -29,16 +68,34 @@ async def process_image(
     hough_thresh: int = Form(50),
     hough_min_len: int = Form(50),
     hough_max_gap: int = Form(10),
+    # Предпросмотр на уменьшенной копии; полное разрешение — отдельной кнопкой
+    preview: bool = Form(False),
 ):
-    # Читаем файл: либо новый, либо из base64
+    # Читаем файл: либо новый, либо сохранённый на сервере по image_id
     if file and file.filename:
-        file_bytes = await file.read()
+        try:
+            with metrics.timed("upload"):
+                file_bytes = await ingest.read_upload(file)
+        except (ingest.UploadTooLargeError, ImageTooLargeError) as e:
+            return templates.TemplateResponse("index.html", {
+                "request": request, 
+                "error": str(e)
+            }, status_code=413)
+        image_id = await store_upload(file_bytes)
+    elif image_id:
+        file_bytes = await load_upload(image_id)
+        if file_bytes is None:
+            return templates.TemplateResponse("index.html", {
+                "request": request, 
+                "error": "Изображение устарело или не найдено, загрузите его заново"
+            }, status_code=410)
     elif original_data:
-        # Декодируем base64 обратно в байты
+        # Старый вариант: base64 оригинала приходит обратно из формы
         import base64
         # Убираем префикс "data:image/png;base64,"
         img_data = original_data.split(',')[1] if ',' in original_data else original_data
         file_bytes = base64.b64decode(img_data)
+        image_id = await store_upload(file_bytes)
     else:
         return templates.TemplateResponse("index.html", {
             "request": request, 
@@ -51,25 +108,51 @@ async def process_image(
         "hough_thresh": hough_thresh, "hough_min_len": hough_min_len, "hough_max_gap": hough_max_gap
     }
 
-    # Запускаем обработку
+    # WebP в data URL, если браузер его принимает (и пресет кодирования разрешает)
+    webp = "image/webp" in request.headers.get("accept", "")
+
+    # Запускаем обработку в пуле
     try:
-        result_data = ImageProcessor.process(file_bytes, method, params)
+        with metrics.timed("pool"):
+            result_data = await pool.run(ImageProcessor.process, file_bytes, method, params, image_id,
+                                         preview, webp)
+    except PoolBusyError as e:
+        return templates.TemplateResponse("index.html", {
+            "request": request, 
+            "error": str(e)
+        }, status_code=503, headers={"Retry-After": "1"})
+    except PoolTimeoutError as e:
+        return templates.TemplateResponse("index.html", {
+            "request": request, 
+            "error": f"Ошибка обработки: {str(e)}"
+        }, status_code=504)
+    except ImageTooLargeError as e:
+        return templates.TemplateResponse("index.html", {
+            "request": request, 
+            "error": str(e)
+        }, status_code=413)
     except Exception as e:
         return templates.TemplateResponse("index.html", {
             "request": request, 
             "error": f"Ошибка обработки: {str(e)}"
         })
 
-    # Возвращаем страницу с результатом
-    return templates.TemplateResponse("index.html", {
-        "request": request, 
-        "result": result_data['result'],
-        "original": result_data['original'],
-        "original_hist": result_data['original_hist'],
-        "result_hist": result_data['result_hist'],
-        "selected_method": method,
-        "params": params
-    })
+    # Возвращаем страницу с результатом (шаблон рендерится при создании ответа)
+    with metrics.timed("render"):
+        return templates.TemplateResponse("index.html", {
+            "request": request, 
+            "result": result_data['result'],
+            "result_ext": result_data['result_ext'],
+            "original": result_data['original'],
+            "original_ext": result_data['original_ext'],
+            "original_hist": result_data['original_hist'],
+            "result_hist": result_data['result_hist'],
+            "selected_method": method,
+            "image_id": image_id,
+            "preview": result_data['preview'],
+            "result_size": (result_data['width'], result_data['height']),
+            "params": params
+        })
 
 if __name__ == "__main__":
     import uvicorn
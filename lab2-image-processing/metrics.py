@@ -0,0 +1,256 @@
+"""
+Метрики сервиса: гистограммы задержек по этапам, мегапиксели, байты, запросы в работе.
+
+- metrics.timed("decode") — замер этапа: пишет в гистограмму cv_stage_seconds и в
+  тайминги текущего запроса (для заголовка Server-Timing).
+- MetricsMiddleware — ASGI-middleware: задержка и счётчики по маршрутам, байты
+  входа/выхода, in-flight, Server-Timing (CV_SERVER_TIMING=1) и профилирование
+  отдельных запросов cProfile (CV_PROFILE=1 и заголовок X-Profile: 1, либо
+  случайная доля запросов CV_PROFILE_SAMPLE).
+- render() — текст в формате Prometheus для /metrics.
+"""
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MEGAPIXEL_BUCKETS = (0.1, 0.3, 1, 2, 4, 8, 12, 16, 24, 50)
+
+SERVER_TIMING = os.environ.get("CV_SERVER_TIMING", "0") == "1"
+PROFILE = os.environ.get("CV_PROFILE", "0") == "1"
+PROFILE_SAMPLE = float(os.environ.get("CV_PROFILE_SAMPLE", 0))
+PROFILE_DIR = os.environ.get("CV_PROFILE_DIR", "profiles")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Значение задаётся вручную (inc/dec) или функцией, вызываемой при чтении"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._func = func
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def render(self):
+        if self._func is not None:
+            items = sorted(self._func().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label_values -> [счётчики по корзинам..., sum, count]
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), label_values + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            base = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{base} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+REQUESTS = Counter("cv_requests_total", "HTTP-запросы по маршруту и статусу", ("route", "status"))
+REQUEST_SECONDS = Histogram("cv_request_seconds", "Полное время обработки HTTP-запроса", ("route",))
+IN_FLIGHT = Gauge("cv_in_flight_requests", "Запросы в работе")
+BYTES_IN = Counter("cv_bytes_in_total", "Байты тела запросов", ("route",))
+BYTES_OUT = Counter("cv_bytes_out_total", "Байты тела ответов", ("route",))
+STAGE_SECONDS = Histogram("cv_stage_seconds", "Время этапов обработки", ("stage",))
+IMAGE_MEGAPIXELS = Histogram("cv_image_megapixels", "Размер декодированных изображений, МП",
+                             buckets=MEGAPIXEL_BUCKETS)
+
+
+class RequestStats:
+    """Данные одного запроса, доступные и в пуле потоков (через копию контекста)"""
+
+    def __init__(self, profile=False):
+        self.timings = []
+        self.profile = profile
+        self.profile_path = None
+
+
+_current = contextvars.ContextVar("cv_request_stats", default=None)
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        stats = _current.get()
+        if stats is not None:
+            stats.timings.append((stage, elapsed))
+
+
+def maybe_profile(func):
+    """Оборачивает задачу пула в cProfile, если текущий запрос нужно профилировать"""
+    stats = _current.get()
+    if stats is None or not stats.profile:
+        return func
+
+    def profiled(*args):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{id(stats):x}.prof")
+            profiler.dump_stats(path)
+            stats.profile_path = path
+    return profiled
+
+
+def server_timing(timings):
+    """Значение заголовка Server-Timing; одноимённые этапы суммируются"""
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: метрики по каждому HTTP-запросу и заголовки Server-Timing/X-Profile-File"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        profile = PROFILE and (headers.get(b"x-profile") == b"1"
+                               or (PROFILE_SAMPLE > 0 and random.random() < PROFILE_SAMPLE))
+        stats = RequestStats(profile=profile)
+        token = _current.set(stats)
+        status = {"code": 500}
+        counted = {"in": 0, "out": 0}
+        start = time.perf_counter()
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                counted["in"] += len(message.get("body", b""))
+            return message
+
+        async def send_instrumented(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                extra = []
+                if SERVER_TIMING and stats.timings:
+                    extra.append((b"server-timing", server_timing(stats.timings).encode()))
+                if stats.profile_path:
+                    extra.append((b"x-profile-file", stats.profile_path.encode()))
+                if extra:
+                    message = {**message, "headers": list(message.get("headers", [])) + extra}
+            elif message["type"] == "http.response.body":
+                counted["out"] += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive_counted, send_instrumented)
+        finally:
+            IN_FLIGHT.dec()
+            _current.reset(token)
+            # Метка — шаблон маршрута, который FastAPI кладёт в scope при сопоставлении;
+            # запросы без маршрута (404, отказ middleware до маршрутизации) сводим в одну метку,
+            # чтобы произвольные пути не раздували число рядов
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "other"
+            REQUESTS.inc(1, label, status["code"])
+            REQUEST_SECONDS.observe(time.perf_counter() - start, label)
+            BYTES_IN.inc(counted["in"], label)
+            BYTES_OUT.inc(counted["out"], label)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
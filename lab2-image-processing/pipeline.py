@@ -0,0 +1,214 @@
+"""
+Конвейер обработки: цепочка этапов (например, eq_hsv -> canny -> hough).
+
+Этапы регистрируются декоратором @stage и работают с Context, который хранит
+текущее изображение и запоминает общие промежуточные результаты (серое, HSV,
+карта краёв, градиенты) — каждый считается не больше одного раза на версию
+изображения. Если текущее изображение принадлежит конвейеру (а не передано
+снаружи), этапы пишут результат прямо в него, без лишних копий и merge.
+"""
+import cv2
+import numpy as np
+
+import metrics
+
+STAGES = {}
+DERIVED = {}
+
+# Разделитель этапов в строке метода: "eq_hsv,canny,hough"
+SEPARATOR = ","
+
+
+class Stage:
+    def __init__(self, name, func, params=()):
+        self.name = name
+        self.func = func
+        self.params = params
+
+
+def stage(name, params=()):
+    """Регистрирует функцию func(ctx, params) как этап конвейера"""
+    def register(func):
+        STAGES[name] = Stage(name, func, params)
+        return func
+    return register
+
+
+def derived(name):
+    """Регистрирует производное значение func(ctx), которое запоминается в Context"""
+    def register(func):
+        DERIVED[name] = func
+        return func
+    return register
+
+
+class Context:
+    """Состояние одного запроса: текущее изображение, его производные и артефакты этапов"""
+
+    def __init__(self, image, owned=False):
+        self.image = image
+        # owned=False: изображение чужое (например, из кэша) — менять его нельзя
+        self.owned = owned
+        self.is_edges = False
+        self.artifacts = {}
+        self._memo = {}
+
+    def get(self, name):
+        if name not in self._memo:
+            self._memo[name] = DERIVED[name](self)
+        return self._memo[name]
+
+    def update(self, image, is_edges=False):
+        """Новое изображение конвейера; производные старого больше не действительны"""
+        self.image = image
+        self.owned = True
+        self.is_edges = is_edges
+        self._memo.clear()
+
+    def output(self):
+        """Буфер для записи результата на месте или None, если нужен новый массив"""
+        return self.image if self.owned else None
+
+
+@derived("gray")
+def _gray(ctx):
+    if ctx.image.ndim == 2:
+        return ctx.image
+    return cv2.cvtColor(ctx.image, cv2.COLOR_BGR2GRAY)
+
+
+@derived("hsv")
+def _hsv(ctx):
+    return cv2.cvtColor(ctx.image, cv2.COLOR_BGR2HSV)
+
+
+@derived("edges")
+def _edges(ctx):
+    # После этапа canny его результат и есть карта краёв; иначе — Canny с фиксированными порогами
+    if ctx.is_edges:
+        return ctx.image
+    return cv2.Canny(ctx.get("gray"), 50, 150)
+
+
+@derived("gradients")
+def _gradients(ctx):
+    # С BORDER_REPLICATE cv2.Canny(dx, dy, ...) совпадает с cv2.Canny(gray, ...) пиксель в пиксель
+    gray = ctx.get("gray")
+    dx = cv2.Sobel(gray, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    dy = cv2.Sobel(gray, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    return dx, dy
+
+
+def equalize_lut(hist):
+    """
+    Таблица эквализации по гистограмме канала — та же формула, что в cv2.equalizeHist,
+    но применяется через cv2.LUT, в том числе ко всем каналам за один проход и на месте.
+    """
+    hist = hist.ravel().astype(np.int64)
+    total = int(hist.sum())
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) == 0:
+        return np.zeros(256, np.uint8)
+    first = nonzero[0]
+    if hist[first] == total:
+        return np.full(256, first, np.uint8)
+    scale = np.float32(255.0) / np.float32(total - hist[first])
+    cumulative = (np.cumsum(hist) - hist[first]).astype(np.float32) * scale
+    lut = np.clip(np.rint(cumulative), 0, 255).astype(np.uint8)
+    lut[:first + 1] = 0
+    return lut
+
+
+def detect_lines(edges, threshold, min_len, max_gap):
+    """Отрезки Хафа в виде массива (N, 4): x1, y1, x2, y2"""
+    lines = cv2.HoughLinesP(edges, 1, np.pi/180, threshold,
+                            minLineLength=min_len, maxLineGap=max_gap)
+    if lines is None:
+        return np.empty((0, 4), np.int32)
+    return lines.reshape(-1, 4)
+
+
+def draw_lines(canvas, lines):
+    """Рисует отрезки на canvas (на месте)"""
+    for x1, y1, x2, y2 in lines:
+        cv2.line(canvas, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+    return canvas
+
+
+@stage("canny", params=("canny_t1", "canny_t2"))
+def _canny(ctx, params):
+    edges = cv2.Canny(ctx.get("gray"), int(params["canny_t1"]), int(params["canny_t2"]))
+    ctx.update(edges, is_edges=True)
+
+
+@stage("hough", params=("hough_thresh", "hough_min_len", "hough_max_gap"))
+def _hough(ctx, params):
+    lines = detect_lines(ctx.get("edges"), int(params["hough_thresh"]),
+                         int(params["hough_min_len"]), int(params["hough_max_gap"]))
+    ctx.artifacts["lines"] = lines
+    if ctx.image.ndim == 2:
+        canvas = cv2.cvtColor(ctx.image, cv2.COLOR_GRAY2BGR)
+    else:
+        canvas = ctx.image if ctx.owned else ctx.image.copy()
+    ctx.update(draw_lines(canvas, lines))
+
+
+@stage("contrast")
+def _contrast(ctx, params):
+    # Нормализация (растяжение гистограммы) от min/max к 0/255
+    ctx.update(cv2.normalize(ctx.image, ctx.output(), alpha=0, beta=255,
+                             norm_type=cv2.NORM_MINMAX))
+
+
+@stage("eq_rgb")
+def _equalize_rgb(ctx, params):
+    if ctx.image.ndim == 2:
+        ctx.update(cv2.equalizeHist(ctx.image, ctx.output()))
+        return
+    # Одна таблица на канал, все каналы за один проход cv2.LUT — без split/merge
+    luts = np.stack([
+        equalize_lut(cv2.calcHist([ctx.image], [i], None, [256], [0, 256]))
+        for i in range(ctx.image.shape[2])
+    ], axis=-1).reshape(256, 1, -1)
+    ctx.update(cv2.LUT(ctx.image, luts, ctx.output()))
+
+
+@stage("eq_hsv")
+def _equalize_hsv(ctx, params):
+    if ctx.image.ndim == 2:
+        ctx.update(cv2.equalizeHist(ctx.image, ctx.output()))
+        return
+    # Эквализируем только яркость (V): H и S проходят через тождественную таблицу
+    hsv = ctx.get("hsv")
+    identity = np.arange(256, dtype=np.uint8)
+    v_lut = equalize_lut(cv2.calcHist([hsv], [2], None, [256], [0, 256]))
+    cv2.LUT(hsv, np.stack([identity, identity, v_lut], axis=-1).reshape(256, 1, 3), hsv)
+    ctx.update(cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, ctx.output()))
+
+
+def parse(method):
+    """Разбирает строку метода в список этапов; неизвестный этап — ValueError"""
+    names = [name.strip() for name in str(method).split(SEPARATOR) if name.strip()]
+    if not names:
+        raise ValueError("Не задан метод обработки")
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Неизвестный метод: {', '.join(unknown)}. Доступны: {', '.join(STAGES)}")
+    return [STAGES[name] for name in names]
+
+
+def stage_params(method):
+    """Имена параметров, влияющих на результат цепочки, в порядке этапов"""
+    names = []
+    for st in parse(method):
+        names.extend(name for name in st.params if name not in names)
+    return tuple(names)
+
+
+def run(image, method, params, owned=False):
+    """Выполняет цепочку этапов над image; возвращает Context с результатом в ctx.image"""
+    ctx = Context(image, owned=owned)
+    for st in parse(method):
+        with metrics.timed(f"apply_{st.name}"):
+            st.func(ctx, params)
+    return ctx
@@ -1,134 +1,631 @@
 import cv2
 import numpy as np
 import base64
-import matplotlib
-matplotlib.use('Agg')  # Для работы без GUI
-import matplotlib.pyplot as plt
-from io import BytesIO
+import hashlib
+import itertools
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import pipeline
+from cache import source_cache, result_cache
+
+# Параметры отрисовки гистограммы (тот же размер, что и прежний график 8x4 дюйма при 100 dpi)
+HIST_WIDTH = 800
+HIST_HEIGHT = 400
+HIST_MARGIN_LEFT = 60
+HIST_MARGIN_RIGHT = 15
+HIST_MARGIN_TOP = 15
+HIST_MARGIN_BOTTOM = 35
+HIST_GRID_COLOR = (220, 220, 220)
+HIST_SHIFT = 4  # субпиксельная точность для cv2.polylines
+# Цвета в BGR: 'b', 'g', 'r' из палитры matplotlib
+HIST_COLORS = ((255, 0, 0), (0, 128, 0), (0, 0, 255))
+HIST_LABELS = ('Blue', 'Green', 'Red')
+
+# Предпросмотр: максимальная сторона уменьшенного изображения для интерактивной настройки
+PREVIEW_MAX_SIDE = int(os.environ.get("CV_PREVIEW_MAX_SIDE", 1280))
+# Параметры Хафа, измеряемые в пикселях (голоса ~ длине линии) — масштабируются вместе с превью
+SCALED_PARAMS = ("hough_thresh", "hough_min_len", "hough_max_gap")
+
+# Максимальный размер изображения: проверяется по заголовку файла до декодирования
+MAX_MEGAPIXELS = float(os.environ.get("CV_MAX_MEGAPIXELS", 100))
+# Декодирование сразу в уменьшенном виде (для JPEG — масштабированием DCT, без полного кадра в памяти)
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# Маркеры JPEG SOFn, в которых записаны размеры кадра (кроме DHT, JPG и DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Пресеты кодирования результата (CV_ENCODE_PRESET). WebP примерно вдвое меньше JPEG,
+# но кодируется в десятки раз дольше, поэтому включён только в пресете "small"
+ENCODE_PRESETS = {
+    "fast": {"jpeg_quality": 80, "png_compression": 1, "webp": False, "webp_quality": 80},
+    "balanced": {"jpeg_quality": 85, "png_compression": 3, "webp": False, "webp_quality": 80},
+    "small": {"jpeg_quality": 80, "png_compression": 6, "webp": True, "webp_quality": 80},
+}
+ENCODE_PRESET = os.environ.get("CV_ENCODE_PRESET", "balanced")
+if ENCODE_PRESET not in ENCODE_PRESETS:
+    raise ValueError(f"CV_ENCODE_PRESET={ENCODE_PRESET!r}: допустимые значения {', '.join(ENCODE_PRESETS)}")
+# Кодировать оригинал в отдельном потоке, пока выполняется метод и кодируется результат
+PARALLEL_ENCODE = os.environ.get("CV_PARALLEL_ENCODE", "1") == "1"
+MIME_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
+
+# Перебор параметров: максимум комбинаций за запрос и ширина миниатюры на контактном листе
+SWEEP_MAX_COMBINATIONS = 64
+SWEEP_THUMB_WIDTH = 320
+# Методы, для которых поддерживается перебор параметров
+SWEEP_METHODS = ("canny", "hough")
+
+
+class ImageTooLargeError(ValueError):
+    """Размеры изображения превышают MAX_MEGAPIXELS"""
+
+
+_encode_executor = None
+
+
+def encode_executor():
+    """Общий пул для параллельного кодирования; создаётся в том процессе, где нужен"""
+    global _encode_executor
+    if _encode_executor is None:
+        _encode_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="encode")
+    return _encode_executor
+
 
 class ImageProcessor:
     @staticmethod
-    def bytes_to_image(file_bytes):
-        """Конвертирует байты от браузера в формат OpenCV"""
+    def bytes_to_image(file_bytes, reduce=1):
+        """
+        Конвертирует байты от браузера в формат OpenCV.
+        reduce (2, 4 или 8) — декодировать сразу с уменьшением в reduce раз.
+        """
         nparr = np.frombuffer(file_bytes, np.uint8)
-        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return cv2.imdecode(nparr, DECODE_FLAGS[reduce])
 
     @staticmethod
-    def image_to_base64(image, quality=85):
-        """Конвертирует изображение обратно в строку Base64 для HTML с сжатием"""
-        # Используем JPEG для меньшего размера файла
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-        _, buffer = cv2.imencode('.jpg', image, encode_param)
-        img_str = base64.b64encode(buffer).decode('utf-8')
-        return f"data:image/jpeg;base64,{img_str}"
-    
+    def image_size(header):
+        """
+        Размеры (ширина, высота) по заголовку JPEG, PNG, GIF, BMP или WebP без декодирования.
+        Достаточно начала файла; None, если формат не распознан или заголовок обрезан.
+        """
+        try:
+            if header[:8] == b"\x89PNG\r\n\x1a\n":
+                return struct.unpack(">II", header[16:24])
+            if header[:6] in (b"GIF87a", b"GIF89a"):
+                return struct.unpack("<HH", header[6:10])
+            if header[:2] == b"BM":
+                w, h = struct.unpack("<ii", header[18:26])
+                return abs(w), abs(h)
+            if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+                chunk = header[12:16]
+                if chunk == b"VP8 ":
+                    w, h = struct.unpack("<HH", header[26:30])
+                    return w & 0x3FFF, h & 0x3FFF
+                if chunk == b"VP8L":
+                    bits = int.from_bytes(header[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b"VP8X":
+                    return (int.from_bytes(header[24:27], "little") + 1,
+                            int.from_bytes(header[27:30], "little") + 1)
+                return None
+            if header[:2] == b"\xff\xd8":
+                i = 2
+                while i + 9 < len(header):
+                    if header[i] != 0xFF:
+                        return None
+                    marker = header[i + 1]
+                    if marker == 0xFF:  # байт-заполнитель
+                        i += 1
+                        continue
+                    if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # маркеры без длины
+                        i += 2
+                        continue
+                    if marker in JPEG_SOF_MARKERS:
+                        h, w = struct.unpack(">HH", header[i + 5:i + 9])
+                        return w, h
+                    i += 2 + struct.unpack(">H", header[i + 2:i + 4])[0]
+        except struct.error:
+            return None
+        return None
+
     @staticmethod
-    def create_histogram(image):
-        """Создает гистограмму для изображения и возвращает в base64"""
-        plt.figure(figsize=(8, 4))
-        
-        # Если изображение цветное
-        if len(image.shape) == 3:
-            colors = ('b', 'g', 'r')
-            labels = ('Blue', 'Green', 'Red')
-            for i, (color, label) in enumerate(zip(colors, labels)):
-                hist = cv2.calcHist([image], [i], None, [256], [0, 256])
-                plt.plot(hist, color=color, label=label, linewidth=2)
-            plt.legend()
+    def check_dimensions(header):
+        """Размеры по заголовку (или None); ImageTooLargeError, если больше MAX_MEGAPIXELS"""
+        size = ImageProcessor.image_size(header)
+        if size is not None and size[0] * size[1] > MAX_MEGAPIXELS * 1e6:
+            raise ImageTooLargeError(
+                f"Изображение {size[0]}x{size[1]} больше допустимых {MAX_MEGAPIXELS:g} МП")
+        return size
+
+    @staticmethod
+    def reduce_factor(size, max_side):
+        """Наибольший коэффициент 2/4/8, после которого большая сторона ещё не меньше max_side"""
+        if size is None:
+            return 1
+        for factor in (8, 4, 2):
+            # Уменьшенное декодирование округляет размеры вверх
+            if -(-max(size) // factor) >= max_side:
+                return factor
+        return 1
+
+    @staticmethod
+    def is_binary(image):
+        """Одноканальное изображение только из 0 и 255 (например, карта краёв Canny)"""
+        return image.ndim == 2 and cv2.countNonZero(cv2.inRange(image, 1, 254)) == 0
+
+    @staticmethod
+    def choose_format(image, webp=False, preset=None):
+        """
+        Формат для изображения: бинарная карта краёв — PNG (1 бит на пиксель, без
+        артефактов JPEG), фотография — WebP, если клиент его принимает и пресет разрешает, иначе JPEG.
+        """
+        if ImageProcessor.is_binary(image):
+            return '.png'
+        return ImageProcessor.choose_photo_format(webp, preset)
+
+    @staticmethod
+    def choose_photo_format(webp=False, preset=None):
+        """Формат для фотографии (не карты краёв): WebP, если клиент принимает и пресет разрешает"""
+        if webp and ENCODE_PRESETS[preset or ENCODE_PRESET]["webp"]:
+            return '.webp'
+        return '.jpg'
+
+    @staticmethod
+    def encode_image(image, ext='.jpg', quality=None, preset=None):
+        """
+        Кодирует изображение в байты файла (JPEG, PNG или WebP); ext=None — формат
+        по choose_format. Качество и степень сжатия берутся из пресета, quality их заменяет.
+        """
+        settings = ENCODE_PRESETS[preset or ENCODE_PRESET]
+        ext = ext or ImageProcessor.choose_format(image, preset=preset)
+        if ext == '.png':
+            encode_param = [int(cv2.IMWRITE_PNG_COMPRESSION), settings["png_compression"]]
+            if ImageProcessor.is_binary(image):
+                # 1 бит на пиксель: в 5-10 раз меньше 8-битного PNG и быстрее сжимается
+                encode_param += [int(cv2.IMWRITE_PNG_BILEVEL), 1]
+        elif ext == '.webp':
+            encode_param = [int(cv2.IMWRITE_WEBP_QUALITY), quality or settings["webp_quality"]]
         else:
-            # Для grayscale
-            hist = cv2.calcHist([image], [0], None, [256], [0, 256])
-            plt.plot(hist, color='black', linewidth=2)
-        
-        plt.xlabel('Яркость')
-        plt.ylabel('Количество пикселей')
-        plt.title('Гистограмма')
-        plt.grid(alpha=0.3)
-        plt.tight_layout()
-        
-        # Сохраняем в буфер
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        
-        # Конвертируем в base64
-        img_str = base64.b64encode(buf.read()).decode('utf-8')
+            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality or settings["jpeg_quality"]]
+        ok, buffer = cv2.imencode(ext, image, encode_param)
+        if not ok:
+            raise ValueError(f"Не удалось закодировать изображение в {ext}")
+        return buffer.tobytes()
+
+    @staticmethod
+    def image_to_base64(image, ext=None, webp=False):
+        """Конвертирует изображение в data URL для HTML; формат по choose_format, если ext не задан"""
+        ext = ext or ImageProcessor.choose_format(image, webp)
+        img_str = base64.b64encode(ImageProcessor.encode_image(image, ext)).decode('utf-8')
+        return f"data:{MIME_TYPES[ext]};base64,{img_str}"
+
+    @staticmethod
+    def calc_histograms(image):
+        """Считает гистограммы по каналам: список (название, цвет BGR, 256 значений)"""
+        if len(image.shape) == 3:
+            return [
+                (label, color, cv2.calcHist([image], [i], None, [256], [0, 256]).ravel())
+                for i, (label, color) in enumerate(zip(HIST_LABELS, HIST_COLORS))
+            ]
+        hist = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+        return [('Gray', (0, 0, 0), hist)]
+
+    @staticmethod
+    def histogram_data(image):
+        """Возвращает гистограмму в компактном виде для отрисовки на клиенте"""
+        return {
+            label.lower(): hist.astype(np.int64).tolist()
+            for label, _, hist in ImageProcessor.calc_histograms(image)
+        }
+
+    @staticmethod
+    def create_histogram(image):
+        """Рисует гистограмму сразу в массив OpenCV и возвращает PNG в base64"""
+        hists = ImageProcessor.calc_histograms(image)
+        canvas = ImageProcessor._render_histogram(hists)
+        _, buffer = cv2.imencode('.png', canvas, [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
+        img_str = base64.b64encode(buffer).decode('utf-8')
         return f"data:image/png;base64,{img_str}"
 
+    @staticmethod
+    def _render_histogram(hists):
+        """Отрисовка осей, сетки, кривых и легенды (аналог прежнего графика matplotlib)"""
+        canvas = np.full((HIST_HEIGHT, HIST_WIDTH, 3), 255, np.uint8)
+        left, top = HIST_MARGIN_LEFT, HIST_MARGIN_TOP
+        right, bottom = HIST_WIDTH - HIST_MARGIN_RIGHT, HIST_HEIGHT - HIST_MARGIN_BOTTOM
+        font = cv2.FONT_HERSHEY_SIMPLEX
+
+        # Диапазоны осей с полями 5%, как у matplotlib по умолчанию
+        y_max = max(float(hist.max()) for _, _, hist in hists) or 1.0
+        x_lo, x_hi = -0.05 * 255, 255 * 1.05
+        y_lo, y_hi = -0.05 * y_max, y_max * 1.05
+
+        def to_px(xs, ys):
+            px = left + (xs - x_lo) * (right - left) / (x_hi - x_lo)
+            py = bottom - (ys - y_lo) * (bottom - top) / (y_hi - y_lo)
+            return px, py
+
+        # Сетка и подписи делений
+        for x in range(0, 256, 50):
+            px, _ = to_px(x, 0)
+            px = int(round(px))
+            cv2.line(canvas, (px, top), (px, bottom), HIST_GRID_COLOR, 1)
+            cv2.line(canvas, (px, bottom), (px, bottom + 4), (0, 0, 0), 1)
+            cv2.putText(canvas, str(x), (px - 10, bottom + 20), font, 0.4, (0, 0, 0), 1, cv2.LINE_AA)
+        for y in ImageProcessor._nice_ticks(y_max):
+            _, py = to_px(0, y)
+            py = int(round(py))
+            cv2.line(canvas, (left, py), (right, py), HIST_GRID_COLOR, 1)
+            cv2.line(canvas, (left - 4, py), (left, py), (0, 0, 0), 1)
+            label = ImageProcessor._format_count(y)
+            (tw, th), _ = cv2.getTextSize(label, font, 0.4, 1)
+            cv2.putText(canvas, label, (left - 8 - tw, py + th // 2), font, 0.4, (0, 0, 0), 1, cv2.LINE_AA)
+        cv2.rectangle(canvas, (left, top), (right, bottom), (0, 0, 0), 1)
+
+        # Кривые: все 256 точек канала переводятся в пиксели одной векторной операцией
+        xs = np.arange(256, dtype=np.float64)
+        for _, color, hist in hists:
+            px, py = to_px(xs, hist)
+            pts = np.round(np.column_stack((px, py)) * (1 << HIST_SHIFT)).astype(np.int32)
+            cv2.polylines(canvas, [pts], False, color, 2, cv2.LINE_AA, HIST_SHIFT)
+
+        # Легенда только для цветных изображений
+        if len(hists) > 1:
+            row_h = 18
+            box_w, box_h = 90, row_h * len(hists) + 8
+            bx, by = right - box_w - 8, top + 8
+            cv2.rectangle(canvas, (bx, by), (bx + box_w, by + box_h), (255, 255, 255), -1)
+            cv2.rectangle(canvas, (bx, by), (bx + box_w, by + box_h), HIST_GRID_COLOR, 1)
+            for i, (label, color, _) in enumerate(hists):
+                ly = by + 4 + row_h * i + row_h // 2
+                cv2.line(canvas, (bx + 8, ly), (bx + 32, ly), color, 2, cv2.LINE_AA)
+                cv2.putText(canvas, label, (bx + 40, ly + 5), font, 0.45, (0, 0, 0), 1, cv2.LINE_AA)
+        return canvas
+
+    @staticmethod
+    def _nice_ticks(max_value, count=5):
+        """Подбирает «круглые» деления оси Y (шаг 1/2/5 * 10^n)"""
+        raw_step = max_value / count
+        magnitude = 10 ** np.floor(np.log10(raw_step)) if raw_step > 0 else 1
+        step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+        return np.arange(0, max_value + step * 0.5, step)
+
+    @staticmethod
+    def _format_count(value):
+        """Компактная подпись количества пикселей: 1500 -> 1.5k"""
+        for divider, suffix in ((1e6, 'M'), (1e3, 'k')):
+            if value >= divider:
+                return f"{value / divider:g}{suffix}"
+        return f"{value:g}"
+
     @staticmethod
     def apply_canny(image, t1, t2):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, t1, t2)
-        return edges
+        return pipeline.run(image, "canny", {"canny_t1": t1, "canny_t2": t2}).image
+
+    @staticmethod
+    def canny_gradients(image):
+        """Градиенты Собеля для Canny (не зависят от порогов)"""
+        return pipeline.Context(image).get("gradients")
+
+    @staticmethod
+    def hough_edges(image):
+        """Карта краёв для Хафа с фиксированными порогами (не зависит от параметров Хафа)"""
+        return pipeline.Context(image).get("edges")
+
+    @staticmethod
+    def detect_lines(edges, threshold, min_len, max_gap):
+        """Отрезки Хафа в виде массива (N, 4): x1, y1, x2, y2"""
+        return pipeline.detect_lines(edges, threshold, min_len, max_gap)
+
+    @staticmethod
+    def draw_lines(image, lines):
+        return pipeline.draw_lines(image.copy(), lines)
 
     @staticmethod
     def apply_hough_lines(image, threshold, min_len, max_gap):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        # Сначала Canny для выделения краев
-        edges = cv2.Canny(gray, 50, 150)
-        lines_img = image.copy()
-        
-        lines = cv2.HoughLinesP(edges, 1, np.pi/180, threshold, 
-                                minLineLength=min_len, maxLineGap=max_gap)
-        
-        if lines is not None:
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                cv2.line(lines_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        return lines_img
+        return pipeline.run(image, "hough", {
+            "hough_thresh": threshold, "hough_min_len": min_len, "hough_max_gap": max_gap
+        }).image
 
     @staticmethod
     def apply_linear_contrast(image):
         # Нормализация (растяжение гистограммы) от min/max к 0/255
-        return cv2.normalize(image, None, alpha=0, beta=255, 
-                             norm_type=cv2.NORM_MINMAX)
+        return pipeline.run(image, "contrast", {}).image
 
     @staticmethod
     def apply_equalize_rgb(image):
-        # Разделяем каналы, эквализируем каждый, собираем обратно
-        channels = cv2.split(image)
-        eq_channels = [cv2.equalizeHist(ch) for ch in channels]
-        return cv2.merge(eq_channels)
+        # Эквализация каждого канала
+        return pipeline.run(image, "eq_rgb", {}).image
 
     @staticmethod
     def apply_equalize_hsv(image):
-        # Конвертируем в HSV -> эквализируем только яркость (V) -> обратно
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        v_eq = cv2.equalizeHist(v)
-        hsv_eq = cv2.merge((h, s, v_eq))
-        return cv2.cvtColor(hsv_eq, cv2.COLOR_HSV2BGR)
+        # Эквализация только яркости (V) в HSV
+        return pipeline.run(image, "eq_hsv", {}).image
+
+    @staticmethod
+    def content_hash(file_bytes):
+        """Хэш содержимого файла — ключ кэша, не зависящий от имени файла"""
+        return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+    @staticmethod
+    def normalize_params(method, params):
+        """Оставляет только параметры, влияющие на выбранный метод, в фиксированном порядке"""
+        return tuple(int(params.get(name)) for name in pipeline.stage_params(method))
+
+    @staticmethod
+    def make_preview(image, max_side):
+        """
+        Уменьшает изображение до max_side по большей стороне: сначала пирамидой
+        cv2.pyrDown (быстро, со сглаживанием), затем INTER_AREA до точного размера.
+        Возвращает (изображение, коэффициент масштаба).
+        """
+        h, w = image.shape[:2]
+        if max(h, w) <= max_side:
+            return image, 1.0
+        preview = image
+        while max(preview.shape[:2]) >= 2 * max_side:
+            preview = cv2.pyrDown(preview)
+        scale = max_side / max(h, w)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if preview.shape[1::-1] != size:
+            preview = cv2.resize(preview, size, interpolation=cv2.INTER_AREA)
+        return preview, scale
+
+    @staticmethod
+    def scale_params(method, params, scale):
+        """Пересчитывает пиксельные параметры Хафа под масштаб превью"""
+        if scale == 1.0 or not any(st.name == "hough" for st in pipeline.parse(method)):
+            return params
+        scaled = dict(params)
+        for name in SCALED_PARAMS:
+            scaled[name] = max(1, round(int(params.get(name)) * scale))
+        return scaled
+
+    @staticmethod
+    def load_source(file_bytes, key=None, max_side=None):
+        """
+        Декодирует изображение и считает гистограмму оригинала (с кэшированием по хэшу).
+        С max_side источник — уменьшенное превью; его масштаб лежит в source['scale'].
+        Закодированный оригинал добавляется в source['originals'] при первом запросе
+        в нужном формате (см. original_url).
+        """
+        key = key or ImageProcessor.content_hash(file_bytes)
+        cache_key = ImageProcessor.source_key(key, max_side)
+        source = source_cache.get(cache_key)
+        if source is None:
+            size = ImageProcessor.check_dimensions(file_bytes)
+            # Для превью полный кадр не нужен: декодируем сразу в 2/4/8 раз меньше
+            reduce = ImageProcessor.reduce_factor(size, max_side) if max_side is not None else 1
+            with metrics.timed("decode"):
+                img = ImageProcessor.bytes_to_image(file_bytes, reduce)
+            if img is None:
+                raise ValueError("Не удалось декодировать изображение")
+            metrics.IMAGE_MEGAPIXELS.observe(img.shape[0] * img.shape[1] / 1e6)
+            full_side = max(size) if size is not None else max(img.shape[:2])
+            scale = 1.0
+            if max_side is not None:
+                with metrics.timed("preview"):
+                    img, _ = ImageProcessor.make_preview(img, max_side)
+                # Масштаб — относительно полного разрешения, а не уменьшенного декодирования
+                scale = max(img.shape[:2]) / full_side
+            # Закэшированный массив разделяется между запросами — запрещаем его изменение
+            img.flags.writeable = False
+            with metrics.timed("original_hist"):
+                original_hist = ImageProcessor.create_histogram(img)
+                original_hist_data = ImageProcessor.histogram_data(img)
+            source = {
+                'image': img,
+                'scale': scale,
+                'originals': {},
+                'original_hist': original_hist,
+                'original_hist_data': original_hist_data,
+            }
+            source_cache.put(cache_key, source)
+        return source
+
+    @staticmethod
+    def source_key(key, max_side=None):
+        return key if max_side is None else (key, max_side)
+
+    @staticmethod
+    def original_url(source, ext, cache_key, pending=None):
+        """
+        Оригинал в виде data URL в формате ext: кодируется один раз на источник и формат.
+        pending — Future уже запущенного параллельного кодирования.
+        """
+        original = source['originals'].get(ext)
+        if original is None:
+            with metrics.timed("original_encode"):
+                original = pending.result() if pending else ImageProcessor.image_to_base64(source['image'], ext)
+            source['originals'][ext] = original
+            # Повторный put пересчитывает занятую записью память
+            source_cache.put(cache_key, source)
+        return original
+
+    @staticmethod
+    def apply_method(img, method, params):
+        """
+        Применяет метод или цепочку методов через запятую (например, "eq_hsv,canny,hough").
+        Исходное изображение не изменяется.
+        """
+        return pipeline.run(img, method, params).image
+
+    @staticmethod
+    def process(file_bytes, method, params, key=None, preview=False, webp=False):
+        """
+        Результат для HTML-страницы. webp=True — клиент принимает WebP
+        (используется, если его разрешает пресет кодирования).
+        """
+        key = key or ImageProcessor.content_hash(file_bytes)
+        max_side = PREVIEW_MAX_SIDE if preview else None
+        # Формат фотографии, который реально получит клиент (WebP только если его разрешает пресет):
+        # при выключенном WebP ответы для webp=True и False одинаковы и делят одну запись кэша
+        photo_ext = ImageProcessor.choose_photo_format(webp)
+        result_key = ("html", key, method, ImageProcessor.normalize_params(method, params), max_side, photo_ext)
+        cached = result_cache.get(result_key)
+        if cached is not None:
+            return dict(cached)
+
+        source = ImageProcessor.load_source(file_bytes, key, max_side)
+        original_ext = ImageProcessor.choose_format(source['image'], webp)
+        pending = None
+        if PARALLEL_ENCODE and original_ext not in source['originals']:
+            # cv2.imencode отпускает GIL: оригинал кодируется, пока выполняется метод
+            pending = encode_executor().submit(ImageProcessor.image_to_base64, source['image'], original_ext)
+        params = ImageProcessor.scale_params(method, params, source['scale'])
+        res_img = ImageProcessor.apply_method(source['image'], method, params)
+
+        with metrics.timed("result_hist"):
+            result_hist = ImageProcessor.create_histogram(res_img)
+        result_ext = ImageProcessor.choose_format(res_img, webp)
+        with metrics.timed("result_encode"):
+            result_b64 = ImageProcessor.image_to_base64(res_img, result_ext)
+        original = ImageProcessor.original_url(source, original_ext, ImageProcessor.source_key(key, max_side), pending)
+
+        result = {
+            'result': result_b64,
+            'result_ext': result_ext,
+            'original': original,
+            'original_ext': original_ext,
+            'original_hist': source['original_hist'],
+            'result_hist': result_hist,
+            'preview': source['scale'] < 1.0,
+            'width': res_img.shape[1],
+            'height': res_img.shape[0],
+        }
+        result_cache.put(result_key, result)
+        return dict(result)
 
     @staticmethod
-    def process(file_bytes, method, params):
-        img = ImageProcessor.bytes_to_image(file_bytes)
-        original_b64 = ImageProcessor.image_to_base64(img)
-        original_hist = ImageProcessor.create_histogram(img)
-        res_img = img
+    def process_raw(file_bytes, method, params, key=None, ext=None, preview=False):
+        """
+        Результат для API: байты изображения без base64 и гистограммы в виде массивов.
+        ext=None — формат по содержимому (PNG для карты краёв, иначе JPEG).
+        """
+        key = key or ImageProcessor.content_hash(file_bytes)
+        max_side = PREVIEW_MAX_SIDE if preview else None
+        result_key = ("raw", key, method, ImageProcessor.normalize_params(method, params), max_side, ext)
+        cached = result_cache.get(result_key)
+        if cached is not None:
+            return dict(cached)
+
+        source = ImageProcessor.load_source(file_bytes, key, max_side)
+        params = ImageProcessor.scale_params(method, params, source['scale'])
+        res_img = ImageProcessor.apply_method(source['image'], method, params)
 
+        ext = ext or ImageProcessor.choose_format(res_img)
+        with metrics.timed("result_encode"):
+            encoded = ImageProcessor.encode_image(res_img, ext)
+        with metrics.timed("result_hist"):
+            histogram = ImageProcessor.histogram_data(res_img)
+
+        result = {
+            'image_id': key,
+            'method': method,
+            'preview': source['scale'] < 1.0,
+            'width': res_img.shape[1],
+            'height': res_img.shape[0],
+            'channels': 1 if res_img.ndim == 2 else res_img.shape[2],
+            'image': encoded,
+            'media_type': MIME_TYPES[ext],
+            'histogram': histogram,
+            'original_histogram': source['original_hist_data'],
+        }
+        result_cache.put(result_key, result)
+        return dict(result)
+
+    @staticmethod
+    def sweep_size(method, grid):
+        """
+        Число комбинаций перебора по длинам списков значений, без их построения.
+        ValueError — метод без перебора или комбинаций больше SWEEP_MAX_COMBINATIONS.
+        """
+        if method not in SWEEP_METHODS:
+            raise ValueError(f"Перебор параметров поддерживается только для: {', '.join(SWEEP_METHODS)}")
+        size = math.prod(len(grid[name]) for name in pipeline.STAGES[method].params)
+        if size > SWEEP_MAX_COMBINATIONS:
+            raise ValueError(f"Слишком много комбинаций: {size} > {SWEEP_MAX_COMBINATIONS}")
+        return size
+
+    @staticmethod
+    def sweep(image, method, grid, thumb_width=None):
+        """
+        Перебор параметров canny/hough по сетке grid (имя параметра -> список значений).
+        Общие этапы (серое изображение, градиенты Собеля, карта краёв для Хафа) считаются
+        один раз, для каждой комбинации выполняется только зависящий от параметров этап.
+        thumb_width — результат каждой комбинации сразу уменьшается до миниатюры, чтобы
+        в памяти не копились полноразмерные изображения всех комбинаций.
+        Возвращает список (параметры, изображение результата, сводка).
+        """
+        if not ImageProcessor.sweep_size(method, grid):
+            raise ValueError("Не заданы значения параметров для перебора")
+        names = pipeline.STAGES[method].params
+        combos = list(itertools.product(*(grid[name] for name in names)))
+
+        def shrink(img):
+            return ImageProcessor.thumbnail(img, thumb_width) if thumb_width else img
+
+        ctx = pipeline.Context(image)
+        results = []
         if method == "canny":
-            res_img = ImageProcessor.apply_canny(img, int(params.get('canny_t1')), int(params.get('canny_t2')))
-        
-        elif method == "hough":
-            res_img = ImageProcessor.apply_hough_lines(img, int(params.get('hough_thresh')), 
-                                                       int(params.get('hough_min_len')), 
-                                                       int(params.get('hough_max_gap')))
-        
-        elif method == "contrast":
-            res_img = ImageProcessor.apply_linear_contrast(img)
-        
-        elif method == "eq_rgb":
-            res_img = ImageProcessor.apply_equalize_rgb(img)
-            
-        elif method == "eq_hsv":
-            res_img = ImageProcessor.apply_equalize_hsv(img)
-
-        result_hist = ImageProcessor.create_histogram(res_img)
-        
+            dx, dy = ctx.get("gradients")
+            for t1, t2 in combos:
+                edges = cv2.Canny(dx, dy, t1, t2)
+                results.append(({"canny_t1": t1, "canny_t2": t2}, shrink(edges),
+                                {"edge_pixels": int(cv2.countNonZero(edges))}))
+        else:
+            edges = ctx.get("edges")
+            for threshold, min_len, max_gap in combos:
+                lines = pipeline.detect_lines(edges, threshold, min_len, max_gap)
+                results.append(({"hough_thresh": threshold, "hough_min_len": min_len, "hough_max_gap": max_gap},
+                                shrink(pipeline.draw_lines(image.copy(), lines)),
+                                {"lines": lines.tolist()}))
+        return results
+
+    @staticmethod
+    def thumbnail(img, thumb_width=SWEEP_THUMB_WIDTH):
+        """Миниатюра шириной thumb_width (изображение не шире — как есть)"""
+        h, w = img.shape[:2]
+        if w <= thumb_width:
+            return img
+        thumb_h = max(1, round(h * thumb_width / w))
+        return cv2.resize(img, (thumb_width, thumb_h), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def contact_sheet(images, labels, thumb_width=SWEEP_THUMB_WIDTH):
+        """Склеивает результаты (или уже готовые миниатюры) в сетку с подписями параметров"""
+        cols = int(np.ceil(np.sqrt(len(images))))
+        rows = int(np.ceil(len(images) / cols))
+        thumb_h, thumb_w = ImageProcessor.thumbnail(images[0], thumb_width).shape[:2]
+        label_h = 22
+        sheet = np.full((rows * (thumb_h + label_h), cols * thumb_w, 3), 255, np.uint8)
+        for i, (img, label) in enumerate(zip(images, labels)):
+            thumb = ImageProcessor.thumbnail(img, thumb_width)
+            if thumb.ndim == 2:
+                thumb = cv2.cvtColor(thumb, cv2.COLOR_GRAY2BGR)
+            y, x = (i // cols) * (thumb_h + label_h), (i % cols) * thumb_w
+            sheet[y + label_h:y + label_h + thumb_h, x:x + thumb_w] = thumb
+            cv2.putText(sheet, label, (x + 4, y + 16), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 1, cv2.LINE_AA)
+        return sheet
+
+    @staticmethod
+    def process_sweep(file_bytes, method, grid, key=None, ext=None):
+        """Перебор параметров для API: контактный лист и сводка по каждой комбинации"""
+        source = ImageProcessor.load_source(file_bytes, key)
+        results = ImageProcessor.sweep(source['image'], method, grid, thumb_width=SWEEP_THUMB_WIDTH)
+        labels = [" ".join(f"{name.split('_', 1)[1]}={value}" for name, value in params.items())
+                  for params, _, _ in results]
+        sheet = ImageProcessor.contact_sheet([img for _, img, _ in results], labels)
+        ext = ext or ImageProcessor.choose_format(sheet)
         return {
-            'result': ImageProcessor.image_to_base64(res_img),
-            'original': original_b64,
-            'original_hist': original_hist,
-            'result_hist': result_hist
-        }
\ No newline at end of file
+            'image_id': key or ImageProcessor.content_hash(file_bytes),
+            'method': method,
+            'results': [{'params': params, **summary} for params, _, summary in results],
+            'image': ImageProcessor.encode_image(sheet, ext),
+            'media_type': MIME_TYPES[ext],
+        }
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from cache import LRUCache
+from processor import ImageProcessor
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ImageStore:
+    """
+    Хранилище загруженных файлов на стороне сервера: браузер получает короткий
+    идентификатор вместо base64-копии изображения.
+    Файлы держатся в памяти (LRU с бюджетом и TTL) и, если задан spill_dir,
+    дублируются на диск с отдельным бюджетом — так они переживают вытеснение из памяти
+    и перезапуск. Срок жизни на диске отсчитывается от загрузки (время изменения файла),
+    как и в памяти; при запуске каталог просматривается, устаревшие и лишние файлы удаляются.
+    Методы с диском блокируют поток — из async-кода их вызывают через store_upload/load_upload.
+    """
+
+    def __init__(self, max_bytes, ttl=None, spill_dir=None, max_disk_bytes=0):
+        self.memory = LRUCache(max_bytes, ttl=ttl)
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._disk = OrderedDict()  # image_id -> (размер файла, срок жизни или None)
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._scan()
+
+    @staticmethod
+    def is_valid_id(image_id):
+        return bool(image_id) and bool(_ID_RE.match(image_id))
+
+    def put(self, image_id, file_bytes):
+        """Сохраняет исходные байты загрузки под идентификатором (хэшем содержимого)"""
+        self.memory.put(image_id, bytes(file_bytes))
+        if self.spill_dir and len(file_bytes) <= self.max_disk_bytes:
+            self._spill(image_id, file_bytes)
+        return image_id
+
+    def get(self, image_id, disk=True):
+        """
+        Возвращает байты изображения или None, если идентификатор неизвестен/устарел.
+        disk=False — только из памяти, без обращения к диску.
+        """
+        if not self.is_valid_id(image_id):
+            return None
+        file_bytes = self.memory.get(image_id)
+        if file_bytes is None and disk:
+            file_bytes = self.load(image_id)
+        return file_bytes
+
+    def load(self, image_id):
+        """Байты с диска (с возвратом в память) или None, если файла нет или он устарел"""
+        if not self.spill_dir or not self.is_valid_id(image_id):
+            return None
+        loaded = self._load(image_id)
+        if loaded is None:
+            return None
+        file_bytes, expires = loaded
+        # В памяти запись живёт не дольше, чем осталось на диске
+        self.memory.put(image_id, file_bytes, ttl=None if expires is None else max(expires - time.time(), 1e-3))
+        return file_bytes
+
+    def _path(self, image_id):
+        return os.path.join(self.spill_dir, f"{image_id}.bin")
+
+    def _expires(self, mtime):
+        return mtime + self.ttl if self.ttl else None
+
+    def _scan(self):
+        """Восстанавливает индекс диска по файлам прошлых запусков (старые — первыми на вытеснение)"""
+        found = []
+        for entry in os.scandir(self.spill_dir):
+            image_id, ext = os.path.splitext(entry.name)
+            if ext == ".bin" and self.is_valid_id(image_id) and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, image_id, stat.st_size))
+        now = time.time()
+        with self._lock:
+            for mtime, image_id, size in sorted(found):
+                expires = self._expires(mtime)
+                if expires is not None and expires < now:
+                    self._remove_file(image_id)
+                    continue
+                self._disk[image_id] = (size, expires)
+                self._disk_bytes += size
+            self._trim()
+
+    def _spill(self, image_id, file_bytes):
+        with self._lock:
+            if image_id in self._disk:
+                # Повторная загрузка того же файла продлевает срок
+                self._disk.move_to_end(image_id)
+                try:
+                    os.utime(self._path(image_id))
+                except OSError:
+                    pass
+                self._disk[image_id] = (self._disk[image_id][0], self._expires(time.time()))
+                return
+            with open(self._path(image_id), "wb") as f:
+                f.write(file_bytes)
+            self._disk[image_id] = (len(file_bytes), self._expires(time.time()))
+            self._disk_bytes += len(file_bytes)
+            self._trim()
+
+    def _trim(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            oldest, (size, _) = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._remove_file(oldest)
+
+    def _remove_file(self, image_id):
+        try:
+            os.remove(self._path(image_id))
+        except OSError:
+            pass
+
+    def _load(self, image_id):
+        """(байты, срок жизни) с диска или None; устаревший файл удаляется"""
+        with self._lock:
+            entry = self._disk.get(image_id)
+            if entry is None:
+                return None
+            size, expires = entry
+            if expires is not None and expires < time.time():
+                del self._disk[image_id]
+                self._disk_bytes -= size
+                self._remove_file(image_id)
+                return None
+            self._disk.move_to_end(image_id)
+        try:
+            with open(self._path(image_id), "rb") as f:
+                return f.read(), expires
+        except OSError:
+            return None
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_entries"] = len(self._disk)
+        stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+
+image_store = ImageStore(
+    int(float(os.environ.get("CV_STORE_MB", 512)) * 1024 * 1024),
+    ttl=float(os.environ.get("CV_STORE_TTL", 3600)) or None,
+    spill_dir=os.environ.get("CV_STORE_DIR") or None,
+    max_disk_bytes=int(float(os.environ.get("CV_STORE_DISK_MB", 2048)) * 1024 * 1024),
+)
+
+
+def _hash_and_put(file_bytes):
+    return image_store.put(ImageProcessor.content_hash(file_bytes), file_bytes)
+
+
+async def store_upload(file_bytes):
+    """Кладёт загрузку в хранилище; хэш большого файла и запись на диск — вне event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _hash_and_put, file_bytes)
+
+
+async def load_upload(image_id):
+    """Байты загрузки по идентификатору или None; чтение с диска — вне event loop"""
+    file_bytes = image_store.get(image_id, disk=False)
+    if file_bytes is None and image_store.spill_dir:
+        loop = asyncio.get_running_loop()
+        file_bytes = await loop.run_in_executor(None, image_store.load, image_id)
+    return file_bytes
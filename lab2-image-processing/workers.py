@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import metrics
+
+
+class PoolBusyError(Exception):
+    """Очередь пула заполнена — запрос нужно отклонить (503)"""
+
+
+class PoolTimeoutError(Exception):
+    """Обработка не уложилась в отведённое время (504)"""
+
+
+class ProcessingPool:
+    """
+    Ограниченный пул для CPU-нагрузки (OpenCV), чтобы не блокировать event loop.
+    max_pending — сколько задач (выполняемых + ожидающих) допускается одновременно,
+    timeout — сколько секунд запрос ждёт результат.
+    """
+
+    def __init__(self, workers=None, kind="thread", max_pending=None, timeout=30.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт пул по переменным окружения (удобно для Render/Railway)"""
+        workers = int(os.environ.get("CV_WORKERS", 0)) or None
+        max_pending = int(os.environ.get("CV_QUEUE_LIMIT", 0)) or None
+        return cls(
+            workers=workers,
+            kind=os.environ.get("CV_WORKER_KIND", "thread"),
+            max_pending=max_pending,
+            timeout=float(os.environ.get("CV_TIMEOUT", 30)),
+        )
+
+    def start(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="cv-worker")
+        return self
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args):
+        """Выполняет func(*args) в пуле; бросает PoolBusyError / PoolTimeoutError"""
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PoolBusyError("Сервер перегружен, повторите попытку позже")
+            self._pending += 1
+
+        try:
+            if self.kind == "process":
+                future = self._executor.submit(func, *args)
+            else:
+                # Копия контекста переносит в поток тайминги текущего запроса (Server-Timing)
+                context = contextvars.copy_context()
+                future = self._executor.submit(context.run, metrics.maybe_profile(func), *args)
+        except Exception:
+            self._release(None)
+            raise
+        # Слот освобождается только когда задача реально завершилась,
+        # иначе зависшие по таймауту задачи обходили бы ограничение очереди
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise PoolTimeoutError(f"Обработка заняла больше {self.timeout:g} с")
+
+
+# Общий пул приложения (настраивается через CV_WORKERS, CV_WORKER_KIND,
+# CV_QUEUE_LIMIT, CV_TIMEOUT), чтобы не блокировать event loop
+pool = ProcessingPool.from_env()
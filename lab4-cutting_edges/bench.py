@@ -0,0 +1,143 @@
+"""
+Бенчмарк отсечения: поотрезочные midpoint_clip / cyrus_beck_clip против пакетного
+отсечения в одном процессе и в пуле из 1, 2, 4, ... процессов (parallel.ParallelClipper).
+
+Примеры:
+    python bench.py                                   # 10^6 случайных отрезков, окна по умолчанию
+    python bench.py --segments 10000000 --tiles 4     # 10^7 отрезков, окно разбито на 4x4 плитки
+    python bench.py --input scene.npy --workers 1,2,4,8 --save bench.json
+
+Пропускная способность — отсечённых пар (отрезок, окно) в секунду; время пула
+считается без его запуска (первый прогон — прогрев).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+import clipping
+import parallel
+
+DEFAULT_RECT = (40, 40, 120, 120)
+DEFAULT_POLY = [(60, 20), (140, 60), (100, 140), (40, 100)]
+SCALAR = {'midpoint': clipping.midpoint_clip, 'liang_barsky': clipping.liang_barsky_clip,
+          'cyrus_beck': clipping.cyrus_beck_clip}
+
+
+def synthetic_scene(n, seed=0, world=160.0, max_length=20.0):
+    """Детерминированная сцена: n отрезков длиной до max_length в квадрате [0, world]."""
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, world, (n, 2))
+    end = start + rng.uniform(-max_length, max_length, (n, 2))
+    return np.hstack([start, end])
+
+
+def tile(rect, k):
+    """Прямоугольник, разбитый на k x k плиток (как области просмотра)."""
+    xmin, ymin, xmax, ymax = rect
+    xs = np.linspace(xmin, xmax, k + 1)
+    ys = np.linspace(ymin, ymax, k + 1)
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in range(k) for i in range(k)]
+
+
+def default_workers():
+    counts, w = [], 1
+    while w < (os.cpu_count() or 1):
+        counts.append(w)
+        w *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+def best_time(func, repeat):
+    func()  # прогрев (и запуск пула)
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_scalar(segments, windows, algorithm, sample):
+    """Поотрезочный алгоритм на первых sample отрезках; возвращает пар в секунду."""
+    clip_one = SCALAR[algorithm]
+    polygons = [parallel.window_job(w, algorithm)[2].vertices.tolist() for w in windows] \
+        if algorithm == 'cyrus_beck' else windows
+    rows = np.asarray(segments[:sample]).tolist()
+    t0 = time.perf_counter()
+    for window in polygons:
+        for segment in rows:
+            clip_one(segment, window)
+    return len(rows) * len(windows) / (time.perf_counter() - t0)
+
+
+def bench_parallel(segments, windows, algorithm, workers, repeat):
+    """Пакетное отсечение пулом из workers процессов (1 — в текущем процессе); пар в секунду."""
+    with parallel.ParallelClipper(segments, workers, min_segments=0) as clipper:
+        elapsed = best_time(lambda: clipper.clip(windows, algorithm), repeat)
+    return len(segments) * len(windows) / elapsed
+
+
+def print_report(report):
+    print(f"{report['segments']} отрезков, окон: {report['windows']}, ядер: {report['cpu_count']}")
+    for algorithm, entry in report['algorithms'].items():
+        scalar = entry['scalar_per_s']
+        print(f"\n{algorithm}")
+        print(f"  {'поотрезочно':<14} {scalar / 1e6:10.3f} млн/с")
+        base = entry['workers'][0]['per_s']
+        for row in entry['workers']:
+            print(f"  {str(row['workers']) + ' проц.':<14} {row['per_s'] / 1e6:10.3f} млн/с   "
+                  f"x{row['per_s'] / base:5.2f} к 1 процессу   x{row['per_s'] / scalar:7.1f} к поотрезочному")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк отсечения: поотрезочно, пакетно и в пуле процессов")
+    parser.add_argument("--input", help="Сцена (формат input.txt или .npy); иначе — случайные отрезки")
+    parser.add_argument("--segments", type=int, default=1_000_000, help="Число случайных отрезков")
+    parser.add_argument("--workers", help="Числа процессов через запятую (по умолчанию 1, 2, 4, ... до числа ядер)")
+    parser.add_argument("--tiles", type=int, default=1, help="Разбить прямоугольное окно на k x k плиток")
+    parser.add_argument("--algorithms", default="midpoint,cyrus_beck")
+    parser.add_argument("--scalar-sample", type=int, default=20000, help="Отрезков для поотрезочного замера")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="Сохранить результат в JSON")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        segments, rect_window, poly_window = clipping.load_input(args.input)
+    else:
+        segments, rect_window, poly_window = synthetic_scene(args.segments), DEFAULT_RECT, DEFAULT_POLY
+    workers = [int(w) for w in args.workers.split(",")] if args.workers else default_workers()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "segments": len(segments),
+        "windows": args.tiles ** 2,
+        "algorithms": {},
+    }
+    for algorithm in [a.strip() for a in args.algorithms.split(",") if a.strip()]:
+        if args.tiles > 1:
+            windows = tile(rect_window, args.tiles)
+        else:
+            windows = [poly_window if algorithm == 'cyrus_beck' else rect_window]
+        report["algorithms"][algorithm] = {
+            "scalar_per_s": bench_scalar(segments, windows, algorithm, args.scalar_sample),
+            "workers": [{"workers": w, "per_s": bench_parallel(segments, windows, algorithm, w, args.repeat)}
+                        for w in workers],
+        }
+
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,804 @@
+"""
+Отсечение отрезков без графического интерфейса: алгоритмы средней точки и Лианга-Барски
+(прямоугольное окно) и Кируса-Бека (выпуклый многоугольник), поотрезочно и пакетно
+на NumPy, чтение входного файла и запись результата.
+
+Пример:
+    python clipping.py input.txt --algorithm midpoint --out clipped.txt
+    python clipping.py scene.npy --algorithm cyrus_beck --workers 0 --out clipped.txt
+"""
+import argparse
+import math
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+EPSILON = 0.01
+
+INSIDE = 0
+LEFT = 1
+RIGHT = 2
+BOTTOM = 4
+TOP = 8
+
+ALGORITHMS = ('midpoint', 'liang_barsky', 'cyrus_beck')
+
+# Размер блока при потоковом чтении текстового файла
+READ_CHUNK = 1 << 24
+# Окно сцены в бинарном формате лежит рядом с массивом отрезков: scene.npy + scene.window.npy
+WINDOW_SUFFIX = '.window.npy'
+
+
+def get_code(x, y, xmin, ymin, xmax, ymax):
+    """Вычисляет код точки для алгоритма Коэна-Сазерленда (используется в Midpoint)."""
+    code = INSIDE
+    if x < xmin: code |= LEFT
+    if x > xmax: code |= RIGHT
+    if y < ymin: code |= BOTTOM
+    if y > ymax: code |= TOP
+    return code
+
+
+def midpoint_clip(segment, window):
+    """
+    Алгоритм средней точки (Midpoint Subdivision).
+    Использует бинарное разбиение для поиска точки пересечения с границей окна.
+    """
+    x1, y1, x2, y2 = segment
+    xmin, ymin, xmax, ymax = window
+
+    def is_visible(x, y):
+        return xmin <= x <= xmax and ymin <= y <= ymax
+
+    if is_visible(x1, y1) and is_visible(x2, y2):
+        return (x1, y1, x2, y2)
+
+    code1 = get_code(x1, y1, xmin, ymin, xmax, ymax)
+    code2 = get_code(x2, y2, xmin, ymin, xmax, ymax)
+
+    if code1 & code2 != 0:
+        return None
+
+    return _midpoint_recursive(segment, window, 0)
+
+
+def _midpoint_recursive(segment, window, depth):
+    x1, y1, x2, y2 = segment
+    xmin, ymin, xmax, ymax = window
+
+    code1 = get_code(x1, y1, xmin, ymin, xmax, ymax)
+    code2 = get_code(x2, y2, xmin, ymin, xmax, ymax)
+
+    if (code1 | code2) == 0:
+        return segment
+
+    if (code1 & code2) != 0:
+        return None
+
+    if depth > 10 or math.hypot(x1-x2, y1-y2) < 1.0:
+        xm, ym = (x1+x2)/2, (y1+y2)/2
+        if get_code(xm, ym, xmin, ymin, xmax, ymax) == 0:
+             return (xm, ym, xm, ym)
+        return None
+
+    xm, ym = (x1+x2)/2, (y1+y2)/2
+    seg_left = _midpoint_recursive((x1, y1, xm, ym), window, depth+1)
+    seg_right = _midpoint_recursive((xm, ym, x2, y2), window, depth+1)
+
+    if seg_left and seg_right:
+        return (seg_left[0], seg_left[1], seg_right[2], seg_right[3])
+    elif seg_left:
+        return seg_left
+    elif seg_right:
+        return seg_right
+    return None
+
+
+def liang_barsky_clip(segment, window):
+    """
+    Алгоритм Лианга-Барски: точное отсечение прямоугольным окном за O(1).
+    Коды концов сразу отбрасывают полностью видимые и невидимые отрезки, для остальных
+    параметры входа/выхода находятся из четырёх неравенств p*t <= q.
+    """
+    x1, y1, x2, y2 = segment
+    xmin, ymin, xmax, ymax = window
+
+    code1 = get_code(x1, y1, xmin, ymin, xmax, ymax)
+    code2 = get_code(x2, y2, xmin, ymin, xmax, ymax)
+    if (code1 | code2) == 0:
+        return segment
+    if (code1 & code2) != 0:
+        return None
+
+    dx = x2 - x1
+    dy = y2 - y1
+    t_entry = 0.0
+    t_exit = 1.0
+    for p, q in ((-dx, x1 - xmin), (dx, xmax - x1), (-dy, y1 - ymin), (dy, ymax - y1)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            t_entry = max(t_entry, t)
+        else:
+            t_exit = min(t_exit, t)
+    if t_entry > t_exit:
+        return None
+    return (x1 + dx * t_entry, y1 + dy * t_entry, x1 + dx * t_exit, y1 + dy * t_exit)
+
+
+def cyrus_beck_clip(segment, polygon_verts):
+    """
+    Исправленный алгоритм Кируса-Бека.
+    Корректно обрабатывает нормали для CCW (против часовой стрелки) многоугольников.
+    """
+    x1, y1, x2, y2 = segment
+
+    t_entry = 0.0
+    t_exit = 1.0
+
+    dx = x2 - x1
+    dy = y2 - y1
+
+    n = len(polygon_verts)
+    for i in range(n):
+        curr_v = polygon_verts[i]
+        next_v = polygon_verts[(i + 1) % n]
+
+        edge_x = next_v[0] - curr_v[0]
+        edge_y = next_v[1] - curr_v[1]
+
+        normal_x = -edge_y
+        normal_y = edge_x
+
+        W_x = x1 - curr_v[0]
+        W_y = y1 - curr_v[1]
+
+        D_dot_n = dx * normal_x + dy * normal_y
+        W_dot_n = W_x * normal_x + W_y * normal_y
+
+        if D_dot_n == 0:
+            if W_dot_n < 0:
+                return None
+            else:
+                continue
+
+        t = -W_dot_n / D_dot_n
+
+        if D_dot_n > 0:
+            t_entry = max(t_entry, t)
+        else:
+            t_exit = min(t_exit, t)
+
+    if t_entry <= t_exit:
+        new_x1 = x1 + dx * t_entry
+        new_y1 = y1 + dy * t_entry
+        new_x2 = x1 + dx * t_exit
+        new_y2 = y1 + dy * t_exit
+        return (new_x1, new_y1, new_x2, new_y2)
+
+    return None
+
+
+# Сколько отрезков обрабатывается за один проход при отсечении многоугольником:
+# промежуточные массивы имеют размер (BATCH_CHUNK, число рёбер)
+BATCH_CHUNK = 65536
+
+
+def compute_outcodes(x, y, window):
+    """Коды Коэна-Сазерленда сразу для массивов координат x, y."""
+    xmin, ymin, xmax, ymax = window
+    codes = np.zeros(np.shape(x), dtype=np.uint8)
+    codes[x < xmin] |= LEFT
+    codes[x > xmax] |= RIGHT
+    codes[y < ymin] |= BOTTOM
+    codes[y > ymax] |= TOP
+    return codes
+
+
+def as_segment_array(segments):
+    """Отрезки в виде массива (N, 4) float64: x1, y1, x2, y2."""
+    return np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+
+
+def midpoint_clip_batch(segments, window):
+    """
+    Алгоритм средней точки для массива отрезков (N, 4) и окна (xmin, ymin, xmax, ymax).
+    Коды концов считаются для всех отрезков сразу; полностью видимые и невидимые
+    отбрасываются без деления, для остальных деление пополам идёт одновременно,
+    пока шаг не станет меньше EPSILON.
+    Возвращает (массив видимых частей (K, 4), маска видимости (N,)).
+    """
+    segs = as_segment_array(segments)
+    x1, y1, x2, y2 = segs.T
+    code1 = compute_outcodes(x1, y1, window)
+    code2 = compute_outcodes(x2, y2, window)
+
+    visible = (code1 & code2) == 0
+    t_start = np.zeros(len(segs))
+    t_end = np.ones(len(segs))
+
+    partial = np.flatnonzero(visible & ((code1 | code2) != 0))
+    if partial.size:
+        px, py = x1[partial], y1[partial]
+        dx, dy = x2[partial] - px, y2[partial] - py
+        c1, c2 = code1[partial], code2[partial]
+        # Число делений, после которого шаг по самому длинному отрезку меньше EPSILON
+        longest = max(float(np.hypot(dx, dy).max()), EPSILON)
+        steps = int(math.ceil(math.log2(longest / EPSILON))) + 1
+
+        def inside(t):
+            return compute_outcodes(px + dx * t, py + dy * t, window) == 0
+
+        # 1. Видимая точка: делим пополам, отбрасывая половину, лежащую вне окна
+        # по одной из границ (у неё общий бит кода с соответствующим концом)
+        t_vis = np.where(c1 == 0, 0.0, np.where(c2 == 0, 1.0, np.nan))
+        lo, hi = np.zeros(partial.size), np.ones(partial.size)
+        searching = np.isnan(t_vis)
+        for _ in range(steps):
+            if not searching.any():
+                break
+            mid = (lo + hi) / 2
+            code_mid = compute_outcodes(px + dx * mid, py + dy * mid, window)
+            found = searching & (code_mid == 0)
+            t_vis[found] = mid[found]
+            searching &= ~found
+            right = searching & ((code_mid & c1) != 0)
+            left = searching & ~right
+            lo[right], c1[right] = mid[right], code_mid[right]
+            hi[left], c2[left] = mid[left], code_mid[left]
+            searching &= (c1 & c2) == 0
+        found = ~np.isnan(t_vis)
+        t_vis[~found] = 0.0
+
+        # 2. Граница окна между видимой точкой и каждым невидимым концом
+        in_start, out_start = t_vis.copy(), np.zeros(partial.size)
+        in_end, out_end = t_vis.copy(), np.ones(partial.size)
+        for _ in range(steps):
+            mid = (in_start + out_start) / 2
+            ok = inside(mid)
+            in_start = np.where(ok, mid, in_start)
+            out_start = np.where(ok, out_start, mid)
+            mid = (in_end + out_end) / 2
+            ok = inside(mid)
+            in_end = np.where(ok, mid, in_end)
+            out_end = np.where(ok, out_end, mid)
+
+        t_start[partial] = np.where(code1[partial] == 0, 0.0, in_start)
+        t_end[partial] = np.where(code2[partial] == 0, 1.0, in_end)
+        visible[partial] = found
+
+    return _segments_at(segs, t_start, t_end, visible), visible
+
+
+def liang_barsky_clip_batch(segments, window):
+    """
+    Алгоритм Лианга-Барски для массива отрезков (N, 4): точные концы без итераций.
+    Возвращает (массив видимых частей (K, 4), маска видимости (N,)).
+    """
+    segs = as_segment_array(segments)
+    x1, y1, x2, y2 = segs.T
+    xmin, ymin, xmax, ymax = window
+    code1 = compute_outcodes(x1, y1, window)
+    code2 = compute_outcodes(x2, y2, window)
+
+    visible = (code1 & code2) == 0
+    t_start = np.zeros(len(segs))
+    t_end = np.ones(len(segs))
+
+    partial = np.flatnonzero(visible & ((code1 | code2) != 0))
+    if partial.size:
+        px, py = x1[partial], y1[partial]
+        dx, dy = x2[partial] - px, y2[partial] - py
+        # Неравенства p*t <= q для левой, правой, нижней и верхней границ: массивы (K, 4)
+        p = np.column_stack([-dx, dx, -dy, dy])
+        q = np.column_stack([px - xmin, xmax - px, py - ymin, ymax - py])
+        parallel = p == 0
+        t = np.divide(q, p, out=np.zeros_like(q), where=~parallel)
+        entry = np.max(np.where(p < 0, t, 0.0), axis=1)
+        exit_ = np.min(np.where(p > 0, t, 1.0), axis=1)
+        outside = np.any(parallel & (q < 0), axis=1)
+        t_start[partial] = entry
+        t_end[partial] = exit_
+        visible[partial] = ~outside & (entry <= exit_)
+
+    return _segments_at(segs, t_start, t_end, visible), visible
+
+
+def cyrus_beck_clip_batch(segments, polygon_verts):
+    """
+    Алгоритм Кируса-Бека для массива отрезков (N, 4). polygon_verts — вершины
+    многоугольника или уже подготовленный PolygonWindow (см. его clip_batch).
+    Возвращает (массив видимых частей (K, 4), маска видимости (N,)).
+    """
+    return as_polygon_window(polygon_verts).clip_batch(segments)
+
+
+def _cyrus_beck_params(segs, normal_x, normal_y, offset):
+    """
+    Параметры входа/выхода Кируса-Бека сразу для всех отрезков и всех рёбер
+    (блоками по BATCH_CHUNK отрезков). Возвращает (t_start, t_end, visible).
+    """
+    t_start = np.zeros(len(segs))
+    t_end = np.ones(len(segs))
+    visible = np.zeros(len(segs), dtype=bool)
+    for lo in range(0, len(segs), BATCH_CHUNK):
+        x1, y1, x2, y2 = segs[lo:lo + BATCH_CHUNK].T
+        d_dot_n = np.outer(x2 - x1, normal_x) + np.outer(y2 - y1, normal_y)
+        w_dot_n = np.outer(x1, normal_x) + np.outer(y1, normal_y) - offset
+        parallel = d_dot_n == 0
+        t = np.divide(-w_dot_n, d_dot_n, out=np.zeros_like(w_dot_n), where=~parallel)
+        entry = np.max(np.where(d_dot_n > 0, t, 0.0), axis=1, initial=0.0)
+        exit_ = np.min(np.where(d_dot_n < 0, t, 1.0), axis=1, initial=1.0)
+        # Параллельный ребру отрезок снаружи от него невидим целиком
+        outside = np.any(parallel & (w_dot_n < 0), axis=1)
+        t_start[lo:lo + BATCH_CHUNK] = entry
+        t_end[lo:lo + BATCH_CHUNK] = exit_
+        visible[lo:lo + BATCH_CHUNK] = ~outside & (entry <= exit_)
+    return t_start, t_end, visible
+
+
+def _segments_at(segs, t_start, t_end, visible):
+    """Видимые части отрезков по параметрам t_start..t_end (только строки с visible)."""
+    segs, t_start, t_end = segs[visible], t_start[visible], t_end[visible]
+    x1, y1 = segs[:, 0], segs[:, 1]
+    dx, dy = segs[:, 2] - x1, segs[:, 3] - y1
+    return np.column_stack([x1 + dx * t_start, y1 + dy * t_start,
+                            x1 + dx * t_end, y1 + dy * t_end])
+
+
+class PolygonWindow:
+    """
+    Многоугольное окно, подготовленное один раз при загрузке: вершины приведены к
+    обходу против часовой стрелки, выпуклость проверена, нормали рёбер и их
+    скалярные произведения с вершинами лежат в массивах, габарит — для отбрасывания
+    отрезков по кодам без обращения к рёбрам.
+    Выпуклое окно отсекается Кирусом-Беком, невыпуклое — общим алгоритмом
+    (пересечения с рёбрами + проверка середин участков), где из одного отрезка
+    может получиться несколько видимых частей.
+    """
+
+    def __init__(self, vertices):
+        verts = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        # Повторяющиеся подряд вершины (и замыкающая, равная первой) дают рёбра нулевой длины
+        keep = np.any(verts != np.roll(verts, 1, axis=0), axis=1)
+        verts = verts[keep] if keep.any() else verts[:1]
+        if len(verts) < 3:
+            raise ValueError("Многоугольник не задан корректно (меньше 3 вершин)!")
+
+        x, y = verts[:, 0], verts[:, 1]
+        area = (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+        if area == 0:
+            raise ValueError("Многоугольник вырожден (нулевая площадь)")
+        self.clockwise = area < 0
+        if self.clockwise:
+            verts = verts[::-1].copy()
+
+        edges = np.roll(verts, -1, axis=0) - verts
+        next_edges = np.roll(edges, -1, axis=0)
+        cross = edges[:, 0] * next_edges[:, 1] - edges[:, 1] * next_edges[:, 0]
+        dot = np.einsum('ij,ij->i', edges, next_edges)
+        # Выпуклый простой многоугольник: все повороты влево и полный оборот ровно один
+        scale = np.abs(edges).max() ** 2
+        turning = np.arctan2(cross, dot).sum()
+        self.convex = bool(np.all(cross >= -1e-12 * scale) and abs(turning - 2 * np.pi) < 1e-6)
+
+        self.vertices = verts
+        self.edges = edges
+        # Внутренние нормали (для обхода против часовой стрелки) и v·n для каждого ребра
+        self.normal_x = -edges[:, 1]
+        self.normal_y = edges[:, 0].copy()
+        self.offset = verts[:, 0] * self.normal_x + verts[:, 1] * self.normal_y
+        self.bbox = (x.min(), y.min(), x.max(), y.max())
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def clip_batch(self, segments):
+        """
+        Массив отрезков (N, 4) -> (видимые части (K, 4), маска видимости (N,)).
+        Отрезки, целиком лежащие по одну сторону габарита окна, отбрасываются по кодам.
+        """
+        segs = as_segment_array(segments)
+        code1 = compute_outcodes(segs[:, 0], segs[:, 1], self.bbox)
+        code2 = compute_outcodes(segs[:, 2], segs[:, 3], self.bbox)
+        candidates = np.flatnonzero((code1 & code2) == 0)
+        mask = np.zeros(len(segs), dtype=bool)
+        if not candidates.size:
+            return np.empty((0, 4)), mask
+
+        subset = segs[candidates]
+        if self.convex:
+            t_start, t_end, visible = _cyrus_beck_params(subset, self.normal_x, self.normal_y, self.offset)
+            mask[candidates] = visible
+            return _segments_at(subset, t_start, t_end, visible), mask
+
+        pieces, owner = self._clip_concave(subset)
+        mask[candidates[owner]] = True
+        return pieces, mask
+
+    def _clip_concave(self, segs):
+        """
+        Общий случай: параметры пересечений отрезка со всеми рёбрами делят его на участки,
+        участок видим, если его середина внутри многоугольника (правило чётности).
+        Соседние видимые участки сливаются. Возвращает (части (K, 4), индекс отрезка (K,)).
+        """
+        m = len(self.vertices)
+        ax, ay = self.vertices[:, 0], self.vertices[:, 1]
+        ex, ey = self.edges[:, 0], self.edges[:, 1]
+        rows_per_chunk = max(1, (1 << 22) // ((m + 1) * m))
+        all_pieces, all_owners = [], []
+        for lo in range(0, len(segs), rows_per_chunk):
+            chunk = segs[lo:lo + rows_per_chunk]
+            px, py = chunk[:, 0:1], chunk[:, 1:2]
+            dx, dy = chunk[:, 2:3] - px, chunk[:, 3:4] - py
+            denom = dx * ey - dy * ex
+            wx, wy = ax - px, ay - py
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (wx * ey - wy * ex) / denom
+                u = (wx * dy - wy * dx) / denom
+            hit = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+            # Границы участков: 0, точки пересечения, 1 (лишние — nan, после сортировки в конце)
+            bounds = np.concatenate([np.zeros((len(chunk), 1)), np.where(hit, t, np.nan),
+                                     np.ones((len(chunk), 1))], axis=1)
+            bounds.sort(axis=1)
+            bounds[np.isnan(bounds)] = 1.0
+            mid = (bounds[:, :-1] + bounds[:, 1:]) / 2
+            inside = self._contains(px + dx * mid, py + dy * mid) & (bounds[:, 1:] > bounds[:, :-1])
+
+            before = np.zeros_like(inside)
+            before[:, 1:] = inside[:, :-1]
+            after = np.zeros_like(inside)
+            after[:, :-1] = inside[:, 1:]
+            rows, first = np.nonzero(inside & ~before)
+            _, last = np.nonzero(inside & ~after)
+            t_start = bounds[rows, first]
+            t_end = bounds[rows, last + 1]
+            x1, y1 = chunk[rows, 0], chunk[rows, 1]
+            sx, sy = chunk[rows, 2] - x1, chunk[rows, 3] - y1
+            all_pieces.append(np.column_stack([x1 + sx * t_start, y1 + sy * t_start,
+                                               x1 + sx * t_end, y1 + sy * t_end]))
+            all_owners.append(rows + lo)
+        return np.concatenate(all_pieces), np.concatenate(all_owners)
+
+    def _contains(self, x, y):
+        """Точки внутри многоугольника (правило чётности); x, y — массивы одной формы."""
+        ax, ay = self.vertices[:, 0], self.vertices[:, 1]
+        bx, by = np.roll(ax, -1), np.roll(ay, -1)
+        px, py = x[..., None], y[..., None]
+        crosses = (ay > py) != (by > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = ax + (py - ay) * (bx - ax) / (by - ay)
+        return np.count_nonzero(crosses & (px < x_cross), axis=-1) % 2 == 1
+
+
+class SegmentIndex:
+    """
+    Равномерная сетка по габаритам отрезков, строится один раз после загрузки.
+    query(окно) возвращает номера отрезков, чей габарит пересекает окно, просматривая
+    только ячейки под окном, — повторное отсечение сдвинутым окном не зависит от
+    размера всей сцены. Отрезки, покрывающие больше max_cells ячеек, в сетку не
+    кладутся и проверяются при каждом запросе отдельным списком.
+    """
+
+    def __init__(self, segments, per_cell=4, max_cells=64):
+        self.segments = as_segment_array(segments)
+        segs = self.segments
+        n = len(segs)
+        self.box_min_x = np.minimum(segs[:, 0], segs[:, 2])
+        self.box_min_y = np.minimum(segs[:, 1], segs[:, 3])
+        self.box_max_x = np.maximum(segs[:, 0], segs[:, 2])
+        self.box_max_y = np.maximum(segs[:, 1], segs[:, 3])
+        if n == 0:
+            self.origin, self.cell_size, self.nx, self.ny = (0.0, 0.0), 1.0, 1, 1
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.items = self.large = np.empty(0, dtype=np.int64)
+            return
+
+        ox, oy = self.box_min_x.min(), self.box_min_y.min()
+        width = self.box_max_x.max() - ox
+        height = self.box_max_y.max() - oy
+        # Ячейка такого размера, чтобы в среднем на неё приходилось per_cell отрезков
+        area = max(width, EPSILON) * max(height, EPSILON)
+        self.cell_size = math.sqrt(area * per_cell / n)
+        # У вытянутой сцены (полоса) ячеек по длинной стороне было бы больше, чем отрезков:
+        # не больше ceil(sqrt(n / per_cell)) ячеек по каждой оси, т. е. около n / per_cell всего
+        self.cell_size = max(self.cell_size, max(width, height) / math.ceil(math.sqrt(n / per_cell)))
+        self.origin = (ox, oy)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        cx0, cy0 = self._cells(self.box_min_x, self.box_min_y)
+        cx1, cy1 = self._cells(self.box_max_x, self.box_max_y)
+        cols, rows = cx1 - cx0 + 1, cy1 - cy0 + 1
+        counts = cols * rows
+        small = counts <= max_cells
+        self.large = np.flatnonzero(~small)
+
+        # Пары (ячейка, отрезок) для всех ячеек под габаритом каждого отрезка
+        ids = np.flatnonzero(small)
+        counts, cols = counts[ids], cols[ids]
+        owner = np.repeat(ids, counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rep_cols = np.repeat(cols, counts)
+        cell = ((np.repeat(cy0[ids], counts) + local // rep_cols) * self.nx
+                + np.repeat(cx0[ids], counts) + local % rep_cols)
+        order = np.argsort(cell, kind='stable')
+        self.items = owner[order]
+        # Отрезки ячейки c: items[cell_start[c]:cell_start[c + 1]]
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.nx * self.ny), out=self.cell_start[1:])
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _cells(self, x, y):
+        cx = np.clip(((x - self.origin[0]) // self.cell_size).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip(((y - self.origin[1]) // self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return cx, cy
+
+    def query(self, window):
+        """Номера отрезков (по возрастанию), чей габарит пересекает окно (xmin, ymin, xmax, ymax)."""
+        xmin, ymin, xmax, ymax = window
+        (cx0, cx1), (cy0, cy1) = self._cells(np.array([xmin, xmax]), np.array([ymin, ymax]))
+        # Ячейки одной строки сетки идут подряд, и их отрезки — один непрерывный срез items
+        parts = [self.items[self.cell_start[row * self.nx + cx0]:self.cell_start[row * self.nx + cx1 + 1]]
+                 for row in range(cy0, cy1 + 1)]
+        parts.append(self.large)
+        candidates = np.unique(np.concatenate(parts))
+        overlap = ((self.box_min_x[candidates] <= xmax) & (self.box_max_x[candidates] >= xmin)
+                   & (self.box_min_y[candidates] <= ymax) & (self.box_max_y[candidates] >= ymin))
+        return candidates[overlap]
+
+
+def as_polygon_window(polygon):
+    """PolygonWindow из списка вершин (готовый PolygonWindow возвращается как есть)."""
+    return polygon if isinstance(polygon, PolygonWindow) else PolygonWindow(polygon)
+
+
+def parse_input(lines):
+    """
+    Разбирает входной формат: число отрезков, затем по строке "x1 y1 x2 y2" на отрезок,
+    последняя строка — окно "xmin ymin xmax ymax" и, необязательно, вершины многоугольника.
+    Возвращает (отрезки (N, 4), прямоугольное окно, вершины многоугольника).
+    Построчный разбор — эталонный и с точным указанием ошибки; для больших файлов см. load_text.
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    if not lines:
+        raise ValueError("Файл пуст.")
+
+    num_segments = int(lines[0])
+    if len(lines) < num_segments + 2:
+        raise ValueError("Нет строки с отсекающим окном")
+
+    segments = []
+    for i in range(1, num_segments + 1):
+        coords = list(map(float, lines[i].split()))
+        if len(coords) == 4:
+            segments.append((coords[0], coords[1], coords[2], coords[3]))
+        else:
+            raise ValueError(f"Неверное число координат в строке {i+1}")
+
+    last_line_coords = list(map(float, lines[num_segments + 1].split()))
+    rect_window, poly_window = parse_window(last_line_coords)
+    return as_segment_array(segments), rect_window, poly_window
+
+
+def parse_window(last_line_coords):
+    """Последняя строка: прямоугольное окно и, необязательно, вершины многоугольника."""
+    if len(last_line_coords) < 4:
+        raise ValueError("Окно задаётся четырьмя числами: xmin ymin xmax ymax")
+
+    rect_window = (
+        min(last_line_coords[0], last_line_coords[2]),
+        min(last_line_coords[1], last_line_coords[3]),
+        max(last_line_coords[0], last_line_coords[2]),
+        max(last_line_coords[1], last_line_coords[3])
+    )
+
+    poly_window = []
+    if len(last_line_coords) > 4:
+        poly_coords = last_line_coords[4:]
+        if len(poly_coords) % 2 != 0:
+            raise ValueError("Координаты многоугольника должны быть парными (X Y)")
+        poly_window = [(poly_coords[i], poly_coords[i+1]) for i in range(0, len(poly_coords), 2)]
+
+    return rect_window, poly_window
+
+
+def _parse_floats(text):
+    """Все числа из блока текста одним вызовом NumPy, без объекта Python на координату."""
+    with warnings.catch_warnings():
+        # Нечисловой токен NumPy сообщает предупреждением и обрывает разбор
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=np.float64, sep=' ')
+        except DeprecationWarning:
+            raise ValueError("В файле есть нечисловые значения") from None
+
+
+def _tokens_per_line(data):
+    """Число чисел в каждой строке блока байтов data (оканчивается переводом строки)."""
+    chars = np.frombuffer(data, dtype=np.uint8)
+    space = (chars == ord(' ')) | (chars == ord('\t')) | (chars == ord('\r')) | (chars == ord('\n'))
+    starts = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    newlines = np.flatnonzero(chars == ord('\n'))
+    # Номер строки начала числа — сколько переводов строки стоит перед ним
+    return np.bincount(np.searchsorted(newlines, starts), minlength=len(newlines))[:len(newlines)]
+
+
+def load_text(path, chunk_size=READ_CHUNK):
+    """
+    Потоковое чтение текстового формата (см. parse_input) сразу в массив (N, 4):
+    массив выделяется по числу из заголовка и заполняется блоками по chunk_size байт.
+    В каждой строке отрезка должно быть ровно четыре числа; иначе (или при пустых
+    строках) файл разбирается построчно parse_input — он же указывает строку с ошибкой.
+    """
+    with open(path, 'rb') as f:
+        header = b''
+        while not header.strip():
+            header = f.readline()
+            if not header:
+                raise ValueError("Файл пуст.")
+        num_segments = int(header)
+
+        flat = np.empty(num_segments * 4)
+        filled = 0
+        window = None
+        tail = b''
+        while window is None:
+            block = f.read(chunk_size)
+            data = tail + block
+            if block:
+                # Блок режется по последнему переводу строки, остаток идёт в следующий
+                cut = data.rfind(b'\n') + 1
+                data, tail = data[:cut], data[cut:]
+            elif data and not data.endswith(b'\n'):
+                data += b'\n'
+
+            remaining = (len(flat) - filled) // 4
+            if remaining:
+                # Строки отрезков — первые remaining строк блока, дальше строка окна
+                cut = len(data)
+                if data.count(b'\n') > remaining:
+                    cut = -1
+                    for _ in range(remaining):
+                        cut = data.index(b'\n', cut + 1)
+                    cut += 1
+                lines = data[:cut]
+                values = _parse_floats(lines)
+                if len(values) != 4 * lines.count(b'\n') or np.any(_tokens_per_line(lines) != 4):
+                    break
+                flat[filled:filled + len(values)] = values
+                filled += len(values)
+                data = data[cut:]
+            if filled == len(flat):
+                # Как и в parse_input: окно — первая непустая строка после отрезков, остальное не читается
+                line = next((line for line in data.split(b'\n') if line.strip()), None)
+                if line is not None:
+                    window = _parse_floats(line).tolist()
+            if not block:
+                break
+
+    if window is None:
+        # Строка не из четырёх чисел, пустые строки или нет окна — построчный разбор найдёт причину
+        with open(path, 'r') as f:
+            return parse_input(f)
+    rect_window, poly_window = parse_window(window)
+    return flat.reshape(-1, 4), rect_window, poly_window
+
+
+def window_path(path):
+    return os.path.splitext(path)[0] + WINDOW_SUFFIX
+
+
+def save_scene(path, segments, rect_window, poly_window=()):
+    """
+    Бинарный формат: отрезки — .npy (N, 4) float64, который открывается через mmap
+    почти мгновенно; окно — рядом, в <имя>.window.npy, как последняя строка текстового формата.
+    """
+    np.save(path, as_segment_array(segments))
+    window = list(rect_window) + [coord for point in poly_window for coord in point]
+    np.save(window_path(path), np.asarray(window, dtype=np.float64))
+
+
+def load_scene(path, mmap=True):
+    """Читает бинарный формат save_scene; с mmap отрезки не копируются в память при загрузке."""
+    segments = np.load(path, mmap_mode='r' if mmap else None)
+    if segments.ndim != 2 or segments.shape[1] != 4:
+        raise ValueError(f"Ожидался массив отрезков (N, 4), получен {segments.shape}")
+    rect_window, poly_window = parse_window(np.load(window_path(path)).tolist())
+    return segments, rect_window, poly_window
+
+
+def load_input(path):
+    """Читает сцену: .npy — бинарный формат (mmap), иначе — текстовый формат input.txt."""
+    if path.endswith('.npy'):
+        return load_scene(path)
+    return load_text(path)
+
+
+def clip(segments, algorithm, rect_window=None, poly_window=None, index=None):
+    """
+    Пакетное отсечение выбранным алгоритмом: 'midpoint' (деление пополам, с точностью
+    EPSILON) и 'liang_barsky' (точный) — прямоугольным окном, 'cyrus_beck' — многоугольником.
+    index — SegmentIndex, построенный по тем же segments: тогда отсекаются только
+    отрезки, чей габарит пересекает окно (или габарит многоугольника).
+    Возвращает (видимые части (K, 4), маска (N,)).
+    """
+    if algorithm in ('midpoint', 'liang_barsky'):
+        if not rect_window:
+            raise ValueError("Прямоугольное окно не задано (данные в файле отсутствуют)!")
+        clip_batch = liang_barsky_clip_batch if algorithm == 'liang_barsky' else midpoint_clip_batch
+        window, bbox = rect_window, rect_window
+    elif algorithm == 'cyrus_beck':
+        # poly_window — список вершин или PolygonWindow, подготовленный при загрузке
+        if poly_window is None or len(poly_window) < 3:
+            raise ValueError("Многоугольник не задан корректно (меньше 3 вершин)!")
+        clip_batch = cyrus_beck_clip_batch
+        window = as_polygon_window(poly_window)
+        bbox = window.bbox
+    else:
+        raise ValueError(f"Неизвестный алгоритм: {algorithm}. Доступны: {', '.join(ALGORITHMS)}")
+
+    if index is None:
+        return clip_batch(segments, window)
+    candidates = index.query(bbox)
+    clipped, visible = clip_batch(index.segments[candidates], window)
+    mask = np.zeros(len(index), dtype=bool)
+    mask[candidates[visible]] = True
+    return clipped, mask
+
+
+def write_segments(f, segments):
+    """Пишет отрезки в том же формате, что и вход: число, затем "x1 y1 x2 y2" по строкам."""
+    segments = as_segment_array(segments)
+    f.write(f"{len(segments)}\n")
+    np.savetxt(f, segments, fmt="%.10g")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отсечение отрезков прямоугольником или многоугольником")
+    parser.add_argument("input", help="Входной файл (формат input.txt или .npy из --save-scene)")
+    parser.add_argument("--algorithm", "-a", choices=ALGORITHMS, default='midpoint')
+    parser.add_argument("--out", "-o", default="-", help="Файл для результата ('-' — стандартный вывод)")
+    parser.add_argument("--save-scene", help="Сохранить сцену в бинарном формате (.npy) и выйти")
+    parser.add_argument("--workers", "-j", type=int, default=1,
+                        help="Процессов для отсечения (0 — по числу ядер), см. parallel.py")
+    args = parser.parse_args(argv)
+
+    try:
+        segments, rect_window, poly_window = load_input(args.input)
+        if args.save_scene:
+            save_scene(args.save_scene, segments, rect_window, poly_window)
+            print(f"Сохранено {len(segments)} отрезков: {args.save_scene}", file=sys.stderr)
+            return 0
+        start = time.perf_counter()
+        if args.workers == 1:
+            clipped, _ = clip(segments, args.algorithm, rect_window, poly_window)
+        else:
+            import parallel
+            window = poly_window if args.algorithm == 'cyrus_beck' else rect_window
+            (clipped, _), = parallel.clip_parallel(segments, [window], args.algorithm, args.workers or None)
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+
+    if args.out == "-":
+        write_segments(sys.stdout, clipped)
+    else:
+        with open(args.out, 'w') as f:
+            write_segments(f, clipped)
+    print(f"{args.algorithm}: видимых отрезков {len(clipped)} из {len(segments)}, "
+          f"{elapsed * 1000:.1f} мс", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
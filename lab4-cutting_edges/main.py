@@ -1,17 +1,114 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import math
+
+import numpy as np
+
+import clipping
+import parallel
 
 CANVAS_WIDTH = 800
 CANVAS_HEIGHT = 600
 PADDING = 50
-EPSILON = 0.01
 
-INSIDE = 0
-LEFT = 1
-RIGHT = 2
-BOTTOM = 4
-TOP = 8
+ALGORITHM_NAMES = {
+    'midpoint': "Средней точки",
+    'liang_barsky': "Лианга-Барски",
+    'cyrus_beck': "Кируса-Бека",
+}
+
+# Больше стольких отрезков — рисуем их в одно растровое изображение, а не элементами холста
+RASTER_THRESHOLD = 5000
+# Исходные отрезки короче этого (в пикселях) элементами холста не рисуются
+MIN_SCREEN_LENGTH = 0.5
+
+WHITE = (255, 255, 255)
+LIGHTGRAY = (211, 211, 211)
+RED = (255, 0, 0)
+BLACK = (0, 0, 0)
+
+
+def cull_screen_segments(screen, min_length=0.0):
+    """
+    Отбрасывает отрезки вне холста и обрезает выступающие по его границе (экранные
+    координаты (N, 4)); min_length — отбросить и более короткие, в пикселях.
+    """
+    visible, _ = clipping.liang_barsky_clip_batch(screen, (0, 0, CANVAS_WIDTH - 1, CANVAS_HEIGHT - 1))
+    if min_length > 0:
+        lengths = np.hypot(visible[:, 2] - visible[:, 0], visible[:, 3] - visible[:, 1])
+        visible = visible[lengths >= min_length]
+    return visible
+
+
+def _widen(mask, offsets):
+    """Маска (H, W), расширенная сдвигами на offsets [(dx, dy), ...] — кисть без обхода точек."""
+    h, w = mask.shape
+    out = np.zeros_like(mask)
+    for dx, dy in offsets:
+        out[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] |= \
+            mask[max(-dy, 0):h + min(-dy, 0), max(-dx, 0):w + min(-dx, 0)]
+    return out
+
+
+def coverage_mask(shape, screen, spacing=1):
+    """
+    Пиксели под отрезками (экранные координаты (N, 4), внутри холста) — маска (H, W).
+    Точки ставятся через spacing пикселей вдоль большей оси: при кисти шириной spacing
+    линия остаётся сплошной, а точек в spacing раз меньше. Отрезки отсортированы по числу
+    точек, поэтому k-я точка всех ещё не кончившихся отрезков — один срез массивов, без
+    развёртки отрезков в точки. Повторные попадания в пиксель ничего не стоят: маска общая.
+    """
+    h, w = shape
+    flat = np.zeros(h * w, dtype=bool)
+    if not len(screen):
+        return flat.reshape(h, w)
+    x1, y1, x2, y2 = screen.astype(np.float32).T
+    major = np.maximum(np.abs(x2 - x1), np.abs(y2 - y1))
+    # Отрезок короче пикселя — одна точка (уровень детализации для плотных сцен)
+    steps = np.where(major < 1, 1, np.ceil(major / spacing).astype(np.int64) + 1)
+    order = np.argsort(-steps, kind='stable')
+    steps = steps[order]
+    x1, y1 = x1[order], y1[order]
+    dx, dy = (x2[order] - x1) / np.maximum(steps - 1, 1), (y2[order] - y1) / np.maximum(steps - 1, 1)
+    # active[k] — сколько отрезков имеют больше k точек
+    active = np.searchsorted(-steps, -np.arange(1, steps[0] + 1), side='right')
+    for k, n in enumerate(active):
+        xs = np.rint(x1[:n] + dx[:n] * k).astype(np.int32)
+        ys = np.rint(y1[:n] + dy[:n] * k).astype(np.int32)
+        np.clip(xs, 0, w - 1, out=xs)
+        np.clip(ys, 0, h - 1, out=ys)
+        flat[ys * w + xs] = True
+    return flat.reshape(h, w)
+
+
+def rasterize_segments(image, screen, color, width=1):
+    """
+    Рисует отрезки (экранные координаты (N, 4)) в массив image (H, W, 3): общая маска
+    покрытия, расширение её под кисть width x width сдвигами и одна запись цвета.
+    """
+    offsets = range(-(width // 2), width - width // 2)
+    mask = coverage_mask(image.shape[:2], screen, spacing=width)
+    image[_widen(mask, [(dx, dy) for dx in offsets for dy in offsets])] = color
+    return image
+
+
+def stamp_points(image, xs, ys, color, radius):
+    """Закрашенные круги радиуса radius с центрами в точках (xs, ys)."""
+    h, w = image.shape[:2]
+    mask = np.zeros((h, w), dtype=bool)
+    xs, ys = np.rint(xs).astype(np.int64), np.rint(ys).astype(np.int64)
+    ok = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    mask[ys[ok], xs[ok]] = True
+    offsets = range(-radius, radius + 1)
+    image[_widen(mask, [(dx, dy) for dx in offsets for dy in offsets if dx * dx + dy * dy <= radius * radius])] = color
+    return image
+
+
+def photo_from_array(image):
+    """tk.PhotoImage из массива (H, W, 3) uint8 через двоичный PPM — без поэлементного put."""
+    h, w = image.shape[:2]
+    ppm = b"P6 %d %d 255\n" % (w, h) + np.ascontiguousarray(image, dtype=np.uint8).tobytes()
+    return tk.PhotoImage(width=w, height=h, data=ppm, format="PPM")
+
 
 class ClippingApp(tk.Frame):
     def __init__(self, master=None):
@@ -23,6 +120,13 @@ class ClippingApp(tk.Frame):
         self.segments = []
         self.rect_window = None
         self.poly_window = []
+        self.poly_clip_window = None
+        self.segment_index = None
+        self.clipper = None
+        # Растровый слой исходных отрезков (для больших сцен) и показанное изображение
+        self.raster_base = None
+        self.raster_photo = None
+        self.result_photo = None
         
         self.create_widgets()
         self.setup_scaling()
@@ -36,6 +140,7 @@ class ClippingApp(tk.Frame):
 
         tk.Button(control_frame, text="Загрузить данные", command=self.load_data).pack(side="left", padx=5)
         tk.Button(control_frame, text="Отсечь (Midpoint)", command=lambda: self.clip_segments(algorithm='midpoint')).pack(side="left", padx=5)
+        tk.Button(control_frame, text="Отсечь (Liang-Barsky)", command=lambda: self.clip_segments(algorithm='liang_barsky')).pack(side="left", padx=5)
         tk.Button(control_frame, text="Отсечь (Cyrus-Beck)", command=lambda: self.clip_segments(algorithm='cyrus_beck')).pack(side="left", padx=5)
         tk.Button(control_frame, text="Сброс", command=self.reset_canvas).pack(side="right", padx=5)
 
@@ -55,45 +160,47 @@ class ClippingApp(tk.Frame):
         sy = CANVAS_HEIGHT - PADDING - (y - self.Y_WORLD_MIN) * self.scale_y
         return sx, sy
 
+    def segments_to_screen(self, segments):
+        """Перевод массива отрезков (N, 4) в экранные координаты за один проход."""
+        segs = clipping.as_segment_array(segments)
+        screen = np.empty_like(segs)
+        screen[:, 0::2] = PADDING + (segs[:, 0::2] - self.X_WORLD_MIN) * self.scale_x
+        screen[:, 1::2] = CANVAS_HEIGHT - PADDING - (segs[:, 1::2] - self.Y_WORLD_MIN) * self.scale_y
+        return screen
+
+    def blank_raster(self):
+        return np.full((CANVAS_HEIGHT, CANVAS_WIDTH, 3), WHITE, dtype=np.uint8)
+
+    def show_raster(self, image):
+        """Показывает растровый слой под всеми элементами холста (оси и окна остаются сверху)."""
+        self.raster_photo = photo_from_array(image)
+        self.canvas.delete("raster")
+        self.canvas.create_image(0, 0, anchor="nw", image=self.raster_photo, tags="raster")
+        self.canvas.tag_lower("raster")
+
     def load_data(self):
         """Загружает и парсит данные из файла."""
-        filepath = filedialog.askopenfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")])
+        filepath = filedialog.askopenfilename(defaultextension=".txt", filetypes=[
+            ("Text files", "*.txt"), ("NumPy scene", "*.npy"), ("All files", "*.*")])
         if not filepath:
             return
 
         try:
-            with open(filepath, 'r') as f:
-                lines = [line.strip() for line in f if line.strip()]
-            
-            if not lines:
-                raise ValueError("Файл пуст.")
-            
-            num_segments = int(lines[0])
-            
-            self.segments = []
-            for i in range(1, num_segments + 1):
-                coords = list(map(float, lines[i].split()))
-                if len(coords) == 4:
-                    self.segments.append((coords[0], coords[1], coords[2], coords[3]))
-                else:
-                    raise ValueError(f"Неверное число координат в строке {i+1}")
-
-            last_line_coords = list(map(float, lines[num_segments + 1].split()))
-            
-            self.rect_window = (
-                min(last_line_coords[0], last_line_coords[2]),
-                min(last_line_coords[1], last_line_coords[3]),
-                max(last_line_coords[0], last_line_coords[2]),
-                max(last_line_coords[1], last_line_coords[3])
-            )
-            
-            if len(last_line_coords) > 4:
-                poly_coords = last_line_coords[4:]
-                if len(poly_coords) % 2 != 0:
-                    raise ValueError("Координаты многоугольника должны быть парными (X Y)")
-                self.poly_window = [(poly_coords[i], poly_coords[i+1]) for i in range(0, len(poly_coords), 2)]
-            else:
-                self.poly_window = []
+            segments, rect_window, poly_window = clipping.load_input(filepath)
+            # Окно-многоугольник готовится один раз: обход, выпуклость, нормали рёбер.
+            # Некорректный многоугольник загрузке не мешает — об ошибке сообщит отсечение Кирусом-Беком
+            try:
+                poly_clip_window = clipping.PolygonWindow(poly_window)
+            except ValueError:
+                poly_clip_window = None
+            self.segments, self.rect_window, self.poly_window = segments, rect_window, poly_window
+            self.poly_clip_window = poly_clip_window
+            # Сетка по габаритам: при отсечении просматриваются только отрезки под окном
+            self.segment_index = clipping.SegmentIndex(segments)
+            # Окна с большим числом отрезков под ними отсекаются пулом процессов
+            self.close_clipper()
+            self.clipper = parallel.ParallelClipper(segments, index=self.segment_index)
+            num_segments = len(self.segments)
             
             messagebox.showinfo("Успех", f"Загружено {num_segments} отрезков.")
             self.redraw()
@@ -134,9 +241,15 @@ class ClippingApp(tk.Frame):
             screen_coords = [coord for point in self.poly_window for coord in self.W2S(point[0], point[1])]
             self.canvas.create_polygon(screen_coords, outline="purple", fill="", width=2, dash=(5, 3), tags="window_poly")
 
-        for x1, y1, x2, y2 in self.segments:
-            sx1, sy1 = self.W2S(x1, y1)
-            sx2, sy2 = self.W2S(x2, y2)
+        self.raster_base = None
+        if len(self.segments) == 0:
+            return
+        screen = cull_screen_segments(self.segments_to_screen(self.segments), MIN_SCREEN_LENGTH)
+        if len(screen) > RASTER_THRESHOLD:
+            self.raster_base = rasterize_segments(self.blank_raster(), screen, LIGHTGRAY, width=2)
+            self.show_raster(self.raster_base)
+            return
+        for sx1, sy1, sx2, sy2 in screen.tolist():
             self.canvas.create_line(sx1, sy1, sx2, sy2, fill="lightgray", width=2, tags="initial_segment")
 
     def redraw(self):
@@ -148,179 +261,60 @@ class ClippingApp(tk.Frame):
         self.segments = []
         self.rect_window = None
         self.poly_window = []
+        self.poly_clip_window = None
+        self.segment_index = None
+        self.close_clipper()
+        self.raster_base = None
         self.redraw()
         messagebox.showinfo("Сброс", "Данные и холст очищены.")
 
+    def close_clipper(self):
+        if self.clipper is not None:
+            self.clipper.close()
+            self.clipper = None
+
     def clip_segments(self, algorithm):
-        if not self.segments:
+        if len(self.segments) == 0:
             messagebox.showerror("Ошибка", "Сначала загрузите данные!")
             return
             
         self.canvas.delete("clipped_result")
-        clipped_segments = []
         
-        if algorithm == 'midpoint':
-            if not self.rect_window:
-                messagebox.showerror("Ошибка", "Прямоугольное окно не задано (данные в файле отсутствуют)!")
-                return
-            for segment in self.segments:
-                res = self.midpoint_clip(segment, self.rect_window)
-                if res:
-                    clipped_segments.append(res)
-            
-        elif algorithm == 'cyrus_beck':
-            if not self.poly_window or len(self.poly_window) < 3:
-                messagebox.showerror("Ошибка", "Многоугольник не задан корректно (меньше 3 вершин)!")
-                return
-            for segment in self.segments:
-                res = self.cyrus_beck_clip(segment, self.poly_window)
-                if res:
-                    clipped_segments.append(res)
+        try:
+            window = (self.poly_clip_window or self.poly_window) if algorithm == 'cyrus_beck' else self.rect_window
+            (clipped_segments, _), = self.clipper.clip([window], algorithm)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
             
         self.draw_clipped_results(clipped_segments)
         
-        algo_name = "Средней точки" if algorithm == 'midpoint' else "Кируса-Бека"
+        algo_name = ALGORITHM_NAMES[algorithm]
         messagebox.showinfo("Результат", f"Алгоритм: {algo_name}\nВидимых отрезков: {len(clipped_segments)}")
 
     def draw_clipped_results(self, clipped_segments):
-        for x1, y1, x2, y2 in clipped_segments:
-            sx1, sy1 = self.W2S(x1, y1)
-            sx2, sy2 = self.W2S(x2, y2)
-            self.canvas.create_line(sx1, sy1, sx2, sy2, fill="red", width=3, tags="clipped_result")
+        screen = cull_screen_segments(self.segments_to_screen(clipped_segments))
+        if len(screen) > RASTER_THRESHOLD:
+            layer = self.raster_base.copy() if self.raster_base is not None else self.blank_raster()
+            rasterize_segments(layer, screen, RED, width=3)
             r = 3
-            self.canvas.create_oval(sx1-r, sy1-r, sx1+r, sy1+r, fill="red", outline="black")
-            self.canvas.create_oval(sx2-r, sy2-r, sx2+r, sy2+r, fill="red", outline="black")
-
-    def _get_code(self, x, y, xmin, ymin, xmax, ymax):
-        """Вычисляет код точки для алгоритма Коэна-Сазерленда (используется в Midpoint)."""
-        code = INSIDE
-        if x < xmin: code |= LEFT
-        if x > xmax: code |= RIGHT
-        if y < ymin: code |= BOTTOM
-        if y > ymax: code |= TOP
-        return code
-
-    def midpoint_clip(self, segment, window):
-        """
-        Алгоритм средней точки (Midpoint Subdivision).
-        Использует бинарное разбиение для поиска точки пересечения с границей окна.
-        """
-        x1, y1, x2, y2 = segment
-        xmin, ymin, xmax, ymax = window
-
-        def is_visible(x, y):
-            return xmin <= x <= xmax and ymin <= y <= ymax
-
-        if is_visible(x1, y1) and is_visible(x2, y2):
-            return (x1, y1, x2, y2)
-
-        code1 = self._get_code(x1, y1, xmin, ymin, xmax, ymax)
-        code2 = self._get_code(x2, y2, xmin, ymin, xmax, ymax)
-
-        if code1 & code2 != 0:
-            return None
-
-        def find_intersection(P_out, P_in):
-            x_out, y_out = P_out
-            x_in, y_in = P_in
-            
-            for _ in range(100):
-                if math.hypot(x_out - x_in, y_out - y_in) < EPSILON:
-                    return x_in, y_in
-                
-                xm = (x_out + x_in) / 2
-                ym = (y_out + y_in) / 2
-                
-                if self._get_code(xm, ym, xmin, ymin, xmax, ymax) != 0:
-                    x_out, y_out = xm, ym
-                else:
-                    x_in, y_in = xm, ym
-            return x_in, y_in
-
-        return self._midpoint_recursive(segment, window, 0)
-
-    def _midpoint_recursive(self, segment, window, depth):
-        x1, y1, x2, y2 = segment
-        xmin, ymin, xmax, ymax = window
-        
-        code1 = self._get_code(x1, y1, xmin, ymin, xmax, ymax)
-        code2 = self._get_code(x2, y2, xmin, ymin, xmax, ymax)
-        
-        if (code1 | code2) == 0:
-            return segment
-        
-        if (code1 & code2) != 0:
-            return None
-            
-        if depth > 10 or math.hypot(x1-x2, y1-y2) < 1.0:
-            xm, ym = (x1+x2)/2, (y1+y2)/2
-            if self._get_code(xm, ym, xmin, ymin, xmax, ymax) == 0:
-                 return (xm, ym, xm, ym)
-            return None
-
-        xm, ym = (x1+x2)/2, (y1+y2)/2
-        seg_left = self._midpoint_recursive((x1, y1, xm, ym), window, depth+1)
-        seg_right = self._midpoint_recursive((xm, ym, x2, y2), window, depth+1)
-        
-        if seg_left and seg_right:
-            return (seg_left[0], seg_left[1], seg_right[2], seg_right[3])
-        elif seg_left:
-            return seg_left
-        elif seg_right:
-            return seg_right
-        return None
-
-    def cyrus_beck_clip(self, segment, polygon_verts):
-        """
-        Исправленный алгоритм Кируса-Бека.
-        Корректно обрабатывает нормали для CCW (против часовой стрелки) многоугольников.
-        """
-        x1, y1, x2, y2 = segment
-        
-        t_entry = 0.0
-        t_exit = 1.0
-        
-        dx = x2 - x1
-        dy = y2 - y1
-        
-        n = len(polygon_verts)
-        for i in range(n):
-            curr_v = polygon_verts[i]
-            next_v = polygon_verts[(i + 1) % n]
-            
-            edge_x = next_v[0] - curr_v[0]
-            edge_y = next_v[1] - curr_v[1]
-            
-            normal_x = -edge_y
-            normal_y = edge_x
-            
-            W_x = x1 - curr_v[0]
-            W_y = y1 - curr_v[1]
-            
-            D_dot_n = dx * normal_x + dy * normal_y
-            W_dot_n = W_x * normal_x + W_y * normal_y
-            
-            if D_dot_n == 0:
-                if W_dot_n < 0:
-                    return None
-                else:
-                    continue
-            
-            t = -W_dot_n / D_dot_n
-            
-            if D_dot_n > 0:
-                t_entry = max(t_entry, t)
+            for xs, ys in ((screen[:, 0], screen[:, 1]), (screen[:, 2], screen[:, 3])):
+                stamp_points(layer, xs, ys, BLACK, r)
+                stamp_points(layer, xs, ys, RED, r - 1)
+            # Отдельное изображение поверх слоя исходных отрезков: удаляется вместе с
+            # остальными результатами по тегу clipped_result, слой исходных остаётся
+            self.result_photo = photo_from_array(layer)
+            self.canvas.create_image(0, 0, anchor="nw", image=self.result_photo, tags="clipped_result")
+            if self.raster_base is not None:
+                self.canvas.tag_raise("clipped_result", "raster")
             else:
-                t_exit = min(t_exit, t)
-                
-        if t_entry <= t_exit:
-            new_x1 = x1 + dx * t_entry
-            new_y1 = y1 + dy * t_entry
-            new_x2 = x1 + dx * t_exit
-            new_y2 = y1 + dy * t_exit
-            return (new_x1, new_y1, new_x2, new_y2)
-        
-        return None
+                self.canvas.tag_lower("clipped_result")
+            return
+        for sx1, sy1, sx2, sy2 in screen.tolist():
+            self.canvas.create_line(sx1, sy1, sx2, sy2, fill="red", width=3, tags="clipped_result")
+            r = 3
+            self.canvas.create_oval(sx1-r, sy1-r, sx1+r, sy1+r, fill="red", outline="black", tags="clipped_result")
+            self.canvas.create_oval(sx2-r, sy2-r, sx2+r, sy2+r, fill="red", outline="black", tags="clipped_result")
 
 if __name__ == '__main__':
     root = tk.Tk()
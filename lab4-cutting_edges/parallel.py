@@ -0,0 +1,186 @@
+"""
+Параллельное отсечение больших наборов отрезков на нескольких ядрах, в том числе
+сразу несколькими окнами (например, плитками области просмотра).
+
+Массив отрезков не передаётся процессам пула через pickle: отрезки из .npy, открытого
+через mmap (load_scene), процессы открывают сами по имени файла и смещению, остальные
+один раз копируются в разделяемую память (multiprocessing.shared_memory). Задача
+пула — диапазон отрезков и окно; обратно приходят только видимые части и маска
+диапазона. Результаты собираются в порядке (окно, диапазон), поэтому не зависят от
+числа процессов и порядка их завершения и совпадают с clipping.clip.
+
+Пример:
+    with ParallelClipper(segments, workers=4) as clipper:
+        for clipped, mask in clipper.clip([(0, 0, 80, 80), (80, 0, 160, 80), polygon]):
+            ...
+"""
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import clipping
+
+# Если окну достаётся меньше стольких отрезков, оно отсекается в текущем процессе: пул не окупается
+PARALLEL_MIN_SEGMENTS = 200_000
+# Наименьший диапазон одной задачи пула
+MIN_SHARD = clipping.BATCH_CHUNK
+
+# Массив отрезков в процессе пула (mmap файла или разделяемая память)
+_segments = None
+_shm = None
+
+
+def _file_source(segments):
+    """('file', путь, смещение, форма) для непрерывного float64-массива, открытого через mmap, иначе None."""
+    if not isinstance(segments, np.memmap) or segments.dtype != np.float64 \
+            or not segments.flags.c_contiguous or segments.ndim != 2 or segments.shape[1] != 4:
+        return None
+    # Срез memmap — тоже memmap, смещение файла известно только у исходного
+    root = segments
+    while isinstance(root.base, np.memmap):
+        root = root.base
+    if not root.filename:
+        return None
+    offset = root.offset + (segments.ctypes.data - root.ctypes.data)
+    return ('file', root.filename, offset, segments.shape)
+
+
+def _attach(source):
+    """Инициализатор процесса пула: открывает общий массив отрезков без копирования."""
+    global _segments, _shm
+    kind, name, offset, shape = source
+    if kind == 'file':
+        _segments = np.memmap(name, dtype=np.float64, mode='r', offset=offset, shape=shape)
+    else:
+        _shm = shared_memory.SharedMemory(name=name)
+        _segments = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf, offset=offset)
+
+
+def _clip_shard(start, stop, algorithm, rect_window, poly_window):
+    return clipping.clip(_segments[start:stop], algorithm, rect_window, poly_window)
+
+
+def _release(pool, shm):
+    if pool is not None:
+        pool.shutdown()
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+def window_job(window, algorithm):
+    """
+    Окно -> (алгоритм, прямоугольник, многоугольник) для clipping.clip.
+    Прямоугольник (xmin, ymin, xmax, ymax) отсекается алгоритмом algorithm, для
+    'cyrus_beck' — как многоугольник из четырёх вершин; многоугольник (вершины или
+    PolygonWindow) — всегда Кирусом-Беком.
+    """
+    if algorithm not in clipping.ALGORITHMS:
+        raise ValueError(f"Неизвестный алгоритм: {algorithm}. Доступны: {', '.join(clipping.ALGORITHMS)}")
+    if isinstance(window, clipping.PolygonWindow):
+        return 'cyrus_beck', None, window
+    if window is None or len(window) == 0:
+        if algorithm == 'cyrus_beck':
+            raise ValueError("Многоугольник не задан корректно (меньше 3 вершин)!")
+        raise ValueError("Прямоугольное окно не задано (данные в файле отсутствуют)!")
+    coords = np.asarray(window, dtype=np.float64)
+    if coords.shape == (4,):
+        rect = tuple(coords.tolist())
+        if algorithm != 'cyrus_beck':
+            return algorithm, rect, None
+        xmin, ymin, xmax, ymax = rect
+        return 'cyrus_beck', None, clipping.PolygonWindow([(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)])
+    return 'cyrus_beck', None, clipping.PolygonWindow(coords)
+
+
+class ParallelClipper:
+    """
+    Отсечение одного набора отрезков многими окнами в пуле процессов.
+    Пул и разделяемая память создаются при первом окне, которому нужен пул, и
+    освобождаются в close() (или при выходе из with / сборке объекта).
+    index — SegmentIndex по тем же отрезкам: окно, под которым мало отрезков,
+    отсекается по нему в текущем процессе.
+    """
+
+    def __init__(self, segments, workers=None, index=None, min_segments=PARALLEL_MIN_SEGMENTS):
+        self.segments = segments if _file_source(segments) else clipping.as_segment_array(segments)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.index = index
+        self.min_segments = min_segments
+        self._pool = None
+        self._shm = None
+        self._finalizer = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._finalizer is not None:
+            self._finalizer()
+        self._pool = self._shm = self._finalizer = None
+
+    def _start(self):
+        source = _file_source(self.segments)
+        if source is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(self.segments.nbytes, 1))
+            shared = np.ndarray(self.segments.shape, dtype=np.float64, buffer=self._shm.buf)
+            shared[:] = self.segments
+            # Пока жив массив поверх buf, память нельзя закрыть
+            del shared
+            source = ('shm', self._shm.name, 0, self.segments.shape)
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_attach, initargs=(source,))
+        self._finalizer = weakref.finalize(self, _release, self._pool, self._shm)
+
+    def shards(self):
+        """Диапазоны [start, stop) задач: по одному на процесс, не короче MIN_SHARD."""
+        n = len(self.segments)
+        size = max(MIN_SHARD, -(-n // self.workers))
+        return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+    def _candidates(self, algorithm, rect_window, poly_window):
+        """Сколько отрезков придётся отсекать окну (по индексу, если он есть)."""
+        if self.index is None:
+            return len(self.segments)
+        return len(self.index.query(rect_window if poly_window is None else poly_window.bbox))
+
+    def clip(self, windows, algorithm='liang_barsky'):
+        """
+        Отсекает все отрезки каждым окном из windows (см. window_job).
+        Возвращает список (видимые части (K, 4), маска (N,)) в порядке окон —
+        то же, что clipping.clip для каждого окна по отдельности.
+        """
+        jobs = [window_job(window, algorithm) for window in windows]
+        results = [None] * len(jobs)
+        pending = {}
+        local = []
+        for i, job in enumerate(jobs):
+            if self.workers > 1 and self._candidates(*job) >= self.min_segments:
+                if self._pool is None:
+                    self._start()
+                pending[i] = [self._pool.submit(_clip_shard, start, stop, *job) for start, stop in self.shards()]
+            else:
+                local.append(i)
+
+        # Небольшие окна отсекаются здесь, пока пул занят остальными
+        for i in local:
+            results[i] = clipping.clip(self.segments, *jobs[i], index=self.index)
+        for i, futures in pending.items():
+            parts = [future.result() for future in futures]
+            results[i] = (np.concatenate([clipped for clipped, _ in parts]),
+                          np.concatenate([mask for _, mask in parts]))
+        return results
+
+
+def clip_parallel(segments, windows, algorithm='liang_barsky', workers=None, min_segments=PARALLEL_MIN_SEGMENTS):
+    """Разовое параллельное отсечение: ParallelClipper(segments, workers).clip(windows, algorithm)."""
+    with ParallelClipper(segments, workers, min_segments=min_segments) as clipper:
+        return clipper.clip(windows, algorithm)